@@ -1,7 +1,18 @@
 
+import bisect
+import logging
+import os
+import random
 import redis
+import threading
+import time
+import timeit
+import uuid
 
+from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
+from wrappers import redis_pool
 
 """This module is meant to provide a distributed locks solution for Celery and Celerybeat.
 When running Celerybeat distributed (for redundancy), each instance will spawn the cron tasks
@@ -13,33 +24,596 @@ module uses Redis as a backend.
 DEFAULT_KEY = "dist_lock:unknown"
 DEFAULT_TIMEOUT = 300  # Five minutes.
 
-# Connection params.
+# Leases are renewed when this fraction of the shortest lease held has elapsed.
+LEASE_RENEWAL_FRACTION = 1 / 3.0
+
+# Waiting for a lock retries after a random delay of up to BACKOFF_BASE seconds,
+# doubling for each retry up to BACKOFF_MAX seconds.
+BACKOFF_BASE = 0.01
+BACKOFF_MAX = 1.0
+
+# Releases are published to this channel prefix plus the lock key.
+RELEASE_CHANNEL_PREFIX = "dist_lock_released:"
+
+# Upper bounds (seconds) of the acquire latency and hold time histogram buckets.
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300, float("inf"))
+DEFAULT_FLUSH_INTERVAL = 60
+
+# Connection params, used unless the pool is configured with `configure_redis`.
 DB = 1
 HOST = "localhost"
 PASSWORD = None
 PORT = 6379
 
-_redis = None
+POOL_NAME = "dist_locks"
+
+# Thread local stack of (keys, won locks) for active `lock_batch` contexts.
+_local = threading.local()
+
+logger = logging.getLogger(__name__)
+
+# Extend each key (KEYS[i]) by ARGV[2i] milliseconds if it still holds token
+# ARGV[2i - 1]. Returns 1 for each renewed key and 0 for each lost one.
+_RENEW_SCRIPT = """
+local renewed = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[2 * i - 1] then
+        redis.call('pexpire', key, ARGV[2 * i])
+        renewed[i] = 1
+    else
+        renewed[i] = 0
+    end
+end
+return renewed
+"""
+
+# Delete KEYS[1] only if it still holds token ARGV[1], and publish the release to
+# channel ARGV[2].
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', ARGV[2], KEYS[1])
+    return 1
+end
+return 0
+"""
+
+# For each key (KEYS[i]) that still holds token ARGV[2i - 1], delete it and publish
+# the release to channel ARGV[2i]. Returns 1 for each released key and 0 for each
+# that had expired or changed owner.
+_RELEASE_MANY_SCRIPT = """
+local released = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[2 * i - 1] then
+        redis.call('del', key)
+        redis.call('publish', ARGV[2 * i], key)
+        released[i] = 1
+    else
+        released[i] = 0
+    end
+end
+return released
+"""
+
+_scripts = {}
+
+
+def configure_redis(**settings):
+    """Set the Redis connection and pool settings (see redis_pool.RedisPoolProvider)
+    used for locks, e.g. `configure_redis(url="redis://redis:6379/1")`.
+    """
+    return redis_pool.configure(POOL_NAME, **settings)
 
 
 def _get_redis_connection():
-    global _redis
-    if _redis is None:
-        _redis = redis.Redis(
-            host=HOST,
-            port=PORT,
-            password=PASSWORD,
-            db=DB
-        )
+    return redis_pool.get_redis_connection(
+        POOL_NAME,
+        host=HOST,
+        port=PORT,
+        password=PASSWORD,
+        db=DB
+    )
+
+
+def _run_script(source, keys, args):
+    """Run a Lua script by its SHA, loading it into Redis when needed."""
+    connection = _get_redis_connection()
+    if source not in _scripts:
+        _scripts[source] = connection.register_script(source)
+    return _scripts[source](keys=keys, args=args, client=connection)
+
+
+class _LeaseRenewer(object):
+    """Renews every lease held by this process from one background thread, with
+    a single scripted call per interval. Leases that could not be renewed
+    (because the key expired or changed owner) are recorded as lost. Adding a
+    lease wakes the thread, so a lease shorter than those already held is renewed
+    in time.
+    """
+    def __init__(self):
+        self._leases = {}
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, key, token, lease):
+        """Start renewing `key`, held with `token`, every so often for `lease` seconds."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's leases and thread do not belong to this process.
+                self._leases = {}
+                self._lost = set()
+                self._wakeup = threading.Event()
+                self._thread = None
+                self._pid = os.getpid()
+
+            self._leases[key] = (token, int(lease * 1000))
+            self._lost.discard(key)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="dist-lock-renewer")
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+
+    def remove(self, key):
+        """Stop renewing `key`. Return Boolean indicating if its lease was lost."""
+        with self._lock:
+            self._leases.pop(key, None)
+            lost = key in self._lost
+            self._lost.discard(key)
+            return lost
+
+    def renew(self):
+        """Renew all leases in one call. Return the number of leases held."""
+        with self._lock:
+            leases = list(self._leases.items())
+        if not leases:
+            return 0
+
+        args = []
+        for key, (token, lease_ms) in leases:
+            args.extend((token, lease_ms))
+        renewed = _run_script(_RENEW_SCRIPT, [key for key, _ in leases], args)
+
+        with self._lock:
+            for (key, (token, _)), success in zip(leases, renewed):
+                if not success and self._leases.get(key, (None,))[0] == token:
+                    logger.warning("Lost lease on distributed lock %s.", key)
+                    self._leases.pop(key)
+                    self._lost.add(key)
+        return len(leases)
+
+    def _get_interval(self):
+        with self._lock:
+            if not self._leases:
+                return None
+            return min(lease_ms for _, lease_ms in self._leases.values()) / 1000.0 * (
+                LEASE_RENEWAL_FRACTION
+            )
+
+    def _run(self):
+        renewed_at = time.time()
+        while True:
+            # Cleared before reading the leases, so a lease added after this is
+            # never missed.
+            self._wakeup.clear()
+            interval = self._get_interval()
+            if interval is None:
+                with self._lock:
+                    if not self._leases:
+                        self._thread = None
+                        return
+                continue
+
+            remaining = renewed_at + interval - time.time()
+            if remaining > 0:
+                # Woken early when a lease is added, to recompute the interval.
+                self._wakeup.wait(remaining)
+                continue
+
+            renewed_at = time.time()
+            try:
+                self.renew()
+            except redis.RedisError:
+                logger.exception("Failed to renew distributed lock leases.")
+
+
+_renewer = _LeaseRenewer()
+
+
+class _LocalLocks(object):
+    """Per-process locks by key, so threads of one process waiting for the same
+    key queue here and only one of them at a time contends in Redis.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._held = set()
+        self._pid = None
+
+    def acquire(self, key, timeout):
+        """Wait up to `timeout` seconds for `key`. Return Boolean indicating if it
+        was acquired.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            if self._pid != os.getpid():
+                # Forked: keys held by the parent's threads are not held here.
+                self._held = set()
+                self._pid = os.getpid()
+
+            while key in self._held:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+            self._held.add(key)
+            return True
+
+    def release(self, key):
+        with self._condition:
+            self._held.discard(key)
+            self._condition.notify_all()
+
+
+_local_locks = _LocalLocks()
+
+
+class MetricsSink(object):
+    """Receives lock metrics (see `set_metrics_sink`). Subclasses override
+    `increment` for per-key counters and `observe` for per-key durations.
+
+    Counters: attempts, wins, losses, bypasses (`ignore_lock`), releases, and
+    expirations (locks found expired or taken over when released or renewed).
+    Durations: acquire_seconds (including waiting) and hold_seconds.
+    """
+    def increment(self, key, name, value=1):
+        pass
+
+    def observe(self, key, name, seconds):
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """Keeps counters and histograms (bucketed by HISTOGRAM_BUCKETS) in memory."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.histograms = defaultdict(dict)
+
+    def increment(self, key, name, value=1):
+        with self._lock:
+            self.counters[key][name] += value
+
+    def observe(self, key, name, seconds):
+        with self._lock:
+            histogram = self.histograms[key].get(name)
+            if histogram is None:
+                histogram = self.histograms[key][name] = {
+                    "buckets": [0] * len(HISTOGRAM_BUCKETS),
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                }
+            histogram["buckets"][bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    def snapshot(self, reset=False):
+        """Return {key: {"counters": {...}, "histograms": {...}}} of the metrics
+        recorded so far, and start over if `reset` is True.
+        """
+        with self._lock:
+            snapshot = dict(
+                (key, {
+                    "counters": dict(self.counters.get(key, {})),
+                    "histograms": dict(
+                        (name, dict(histogram, buckets=list(histogram["buckets"])))
+                        for name, histogram in self.histograms.get(key, {}).items()
+                    ),
+                })
+                for key in set(self.counters) | set(self.histograms)
+            )
+            if reset:
+                self._reset()
+            return snapshot
+
+
+class LoggingSink(InMemorySink):
+    """InMemorySink that logs and resets its metrics at most every `interval`
+    seconds, checked whenever a metric is recorded, and when `flush` is called.
+    """
+    def __init__(self, interval=DEFAULT_FLUSH_INTERVAL, log=None, level=logging.INFO):
+        super(LoggingSink, self).__init__()
+        self.interval = interval
+        self.log = log or logger
+        self.level = level
+        self._flushed_at = timeit.default_timer()
+
+    def increment(self, key, name, value=1):
+        super(LoggingSink, self).increment(key, name, value)
+        self._check_flush()
 
-    return _redis
+    def observe(self, key, name, seconds):
+        super(LoggingSink, self).observe(key, name, seconds)
+        self._check_flush()
 
+    def _check_flush(self):
+        if timeit.default_timer() - self._flushed_at >= self.interval:
+            self.flush()
 
-def distributed_lock(key=DEFAULT_KEY, timeout=DEFAULT_TIMEOUT):
+    def flush(self):
+        self._flushed_at = timeit.default_timer()
+        snapshot = self.snapshot(reset=True)
+        for key in sorted(snapshot):
+            histograms = snapshot[key]["histograms"]
+            self.log.log(
+                self.level,
+                "Distributed lock %s: %s %s",
+                key,
+                " ".join("{}={}".format(*item) for item in sorted(snapshot[key]["counters"].items())),
+                " ".join(
+                    "{}[count={} mean={:.6f} max={:.6f}]".format(
+                        name,
+                        histogram["count"],
+                        histogram["sum"] / histogram["count"],
+                        histogram["max"]
+                    )
+                    for name, histogram in sorted(histograms.items())
+                )
+            )
+
+
+# Sink receiving lock metrics, None to disable them.
+_sink = None
+
+# Won locks by key, mapped to (acquisition time, timeout), to time holds ended by
+# `release_lock`. Only kept while a sink is set.
+_acquired_at = {}
+
+
+def set_metrics_sink(sink):
+    """Send lock metrics to `sink` (a MetricsSink), or disable them with None.
+
+    Example usage:
+    ```
+    set_metrics_sink(LoggingSink(interval=300))
+    ```
+    """
+    global _sink
+    _sink = sink
+    _acquired_at.clear()
+
+
+def _increment(key, name, value=1):
+    if _sink is not None:
+        _sink.increment(key, name, value)
+
+
+def _observe(key, name, seconds):
+    if _sink is not None:
+        _sink.observe(key, name, seconds)
+
+
+def _record_attempt(key, won, started, timeout=None):
+    """Record a lock attempt for `key` that began at `started`. When won and
+    `timeout` is given, remember the acquisition so `release_lock` can time it.
+    """
+    if _sink is None:
+        return
+    now = timeit.default_timer()
+    _sink.increment(key, "attempts")
+    _sink.increment(key, "wins" if won else "losses")
+    _sink.observe(key, "acquire_seconds", now - started)
+    if won and timeout is not None:
+        _acquired_at[key] = (now, timeout)
+
+
+def _record_release(key, held):
+    """Record the release of `key`. `held` is Boolean indicating if the lock was
+    still held when released.
+    """
+    if _sink is None:
+        return
+    _sink.increment(key, "releases")
+    acquired_at, timeout = _acquired_at.pop(key, (None, None))
+    if acquired_at is not None:
+        hold = timeit.default_timer() - acquired_at
+        _sink.observe(key, "hold_seconds", hold)
+        held = held and hold < timeout
+    if not held:
+        _sink.increment(key, "expirations")
+
+
+def _get_token():
+    """Return a unique value to store in a lock key."""
+    return uuid.uuid4().hex
+
+
+def _get_release_channel(key):
+    return RELEASE_CHANNEL_PREFIX + key
+
+
+def _get_backoff(attempt):
+    """Return a random delay for retry number `attempt` (full jitter)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** min(attempt, 32)))
+
+
+def _get_batch_locks(key):
+    """Return the won locks of the innermost active `lock_batch` that includes
+    `key`, or None when no batch includes it.
+    """
+    for keys, won_locks in reversed(getattr(_local, "batches", ())):
+        if key in keys:
+            return won_locks
+    return None
+
+
+def acquire_locks(keys, timeout=DEFAULT_TIMEOUT):
+    """Attempt non-blocking locks on every key in `keys` (for timeout duration) in
+    a single pipelined round trip. Return a dict of the keys that were won, mapped
+    to the token stored in each.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    started = timeit.default_timer()
+    tokens = [_get_token() for _ in keys]
+    pipeline = _get_redis_connection().pipeline(transaction=False)
+    for key, token in zip(keys, tokens):
+        pipeline.set(key, token, nx=True, ex=timeout)
+    results = pipeline.execute()
+
+    for key, won in zip(keys, results):
+        _record_attempt(key, won, started, timeout)
+    return dict((key, token) for key, token, won in zip(keys, tokens, results) if won)
+
+
+def release_locks(locks):
+    """Manually release many locks, as returned by `acquire_locks` (a dict of keys
+    mapped to their tokens), in a single scripted call. Each lock is only released
+    if it still holds its token, and releases are published for waiters (see
+    `distributed_lock`). Return the number of locks that were held.
+    """
+    locks = list(locks.items())
+    if not locks:
+        return 0
+
+    args = []
+    for key, token in locks:
+        args.extend((token, _get_release_channel(key)))
+    released = _run_script(_RELEASE_MANY_SCRIPT, [key for key, _ in locks], args)
+
+    for (key, _), success in zip(locks, released):
+        _record_release(key, success)
+    return sum(released)
+
+
+@contextmanager
+def lock_batch(keys, timeout=DEFAULT_TIMEOUT):
+    """Context manager that attempts every key in `keys` with `acquire_locks` and
+    yields the won locks. Inside the context, functions decorated with
+    `distributed_lock` for one of the keys run only if its lock was won, without
+    another round trip.
+    """
+    keys = set(keys)
+    won_locks = acquire_locks(keys, timeout)
+    if not hasattr(_local, "batches"):
+        _local.batches = []
+
+    _local.batches.append((keys, won_locks))
+    try:
+        yield won_locks
+    finally:
+        _local.batches.pop()
+
+
+def _acquire(key, token, expiry, wait=0, wakeup=False):
+    """Attempt to set `key` to `token` for `expiry` seconds, retrying with jittered
+    exponential backoff for up to `wait` seconds. With `wakeup`, retries also
+    happen as soon as a release of the key is published. Return Boolean
+    indicating if the lock was acquired.
+    """
+    connection = _get_redis_connection()
+    expiry_ms = int(expiry * 1000)
+    if connection.set(key, token, nx=True, px=expiry_ms):
+        return True
+    if not wait:
+        return False
+
+    deadline = time.time() + wait
+    pubsub = None
+    if wakeup:
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(_get_release_channel(key))
+
+    try:
+        attempt = 0
+        while True:
+            # Also retried straight after subscribing, as the release may have been
+            # published before.
+            if connection.set(key, token, nx=True, px=expiry_ms):
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            delay = min(remaining, _get_backoff(attempt))
+            attempt += 1
+            if pubsub is not None:
+                pubsub.get_message(timeout=delay)
+            else:
+                time.sleep(delay)
+    finally:
+        if pubsub is not None:
+            pubsub.close()
+
+
+def _run_locked(key, timeout, lease, wait, wakeup, run_function, args, kwargs):
+    """Acquire the lock (see `distributed_lock`), and if successful run the function
+    and release the lock, only if still owned, when it returns. With `lease`, a
+    background thread keeps renewing the lock while the function runs.
+    """
+    started = timeit.default_timer()
+    deadline = time.time() + (wait or 0)
+    if not _local_locks.acquire(key, wait or 0):
+        _record_attempt(key, False, started)
+        return None
+
+    try:
+        token = _get_token()
+        expiry = timeout if lease is None else lease
+        won = _acquire(key, token, expiry, max(0, deadline - time.time()), wakeup)
+        # Renewed leases never time out, their loss is detected on release instead.
+        _record_attempt(key, won, started, expiry if lease is None else float("inf"))
+        if not won:
+            return None
+
+        if lease is not None:
+            _renewer.add(key, token, lease)
+        try:
+            return run_function(*args, **kwargs)
+        finally:
+            if lease is not None:
+                _renewer.remove(key)
+            release_lock(key, token)
+    finally:
+        _local_locks.release(key)
+
+
+def distributed_lock(
+    key=DEFAULT_KEY,
+    timeout=DEFAULT_TIMEOUT,
+    lease=None,
+    wait=None,
+    wakeup=False
+):
     """Task.run() decorator.
     When applied, will attempt a non-blocking Redis lock, and only execute the wrapped
     method if successful in applying (for timeout duration). If method is called with
     `ignore_lock` keyword argument with value True, bypass setting/checking lock.
+    Inside a `lock_batch` context that includes `key`, the batch's result is used
+    instead of attempting the lock.
+    When `lease` (seconds) is given, the lock is instead held for a short lease that
+    is renewed while the method runs, and released when it returns, so a crashed
+    worker only holds the lock until the lease runs out.
+    When `wait` (seconds) is given, the lock is awaited for up to that long, retrying
+    with jittered exponential backoff, and released when the method returns. Threads
+    of one process wait for each other locally instead of all polling Redis. With
+    `wakeup`, waiters subscribe to lock releases and retry as soon as one is
+    published, with the backoff only as a fallback.
     """
     def _decorator(run_function):
 
@@ -47,11 +621,33 @@ def distributed_lock(key=DEFAULT_KEY, timeout=DEFAULT_TIMEOUT):
         def _caller(*args, **kwargs):
             # Check for `ignore_lock` keyword argument.
             if 'ignore_lock' in kwargs and kwargs['ignore_lock'] == True:
+                _increment(key, "bypasses")
                 return run_function(*args, **kwargs)
 
+            # Use the lock attempted by an enclosing batch.
+            batch_locks = _get_batch_locks(key)
+            if batch_locks is not None:
+                if key in batch_locks:
+                    return run_function(*args, **kwargs)
+                return None
+
+            if lease is not None or wait is not None:
+                return _run_locked(
+                    key,
+                    timeout,
+                    lease,
+                    wait,
+                    wakeup,
+                    run_function,
+                    args,
+                    kwargs
+                )
+
             # Attempt the lock and return method if successfully applied.
+            started = timeit.default_timer()
             lock = _get_redis_connection().lock(key, timeout=timeout)
             success = lock.acquire(blocking=False)
+            _record_attempt(key, success, started, timeout)
             if success:
                 return run_function(*args, **kwargs)
 
@@ -60,7 +656,18 @@ def distributed_lock(key=DEFAULT_KEY, timeout=DEFAULT_TIMEOUT):
     return _decorator
 
 
-def release_lock(key):
+def release_lock(key, token=None):
     """Manually release a lock. This may be called when exiting a task.
+    When `token` is given, the lock is only released if it still holds that token.
+    Releases are published for waiters (see `distributed_lock`).
     """
-    success = _get_redis_connection().delete(key)
+    if token is not None:
+        released = _run_script(_RELEASE_SCRIPT, [key], [token, _get_release_channel(key)])
+        _record_release(key, released)
+        return released
+
+    connection = _get_redis_connection()
+    success = connection.delete(key)
+    _record_release(key, success)
+    if success:
+        connection.publish(_get_release_channel(key), key)
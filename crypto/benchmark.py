@@ -0,0 +1,253 @@
+
+"""Benchmarks for the crypto package. Every AES mode, each XOR backend and each
+encoder is timed encrypting and decrypting payloads of increasing size, and the
+results are written as JSON so runs can be compared. Each case runs in its own
+process, so its peak resident set size is not inflated by earlier cases.
+
+Run from the crypto directory:
+    python -m benchmark --max-size 16777216 --output results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import timeit
+
+import classes.ciphers
+
+from classes.ciphers.aes import AESCipher
+from classes.encoders import registry as encoders
+from Crypto.Cipher import AES
+
+
+# Constants.
+MODE_NAMES = {
+    AES.MODE_CBC: "CBC",
+    AES.MODE_CFB: "CFB",
+    AES.MODE_CTR: "CTR",
+    AES.MODE_ECB: "ECB",
+    AES.MODE_OFB: "OFB",
+    AES.MODE_OPENPGP: "OPENPGP",
+}
+
+ENCODERS = tuple(encoders.ENCODERS.values())
+
+# 16 B to 1 GB, growing by a factor of four.
+PAYLOAD_SIZES = tuple(16 * 4 ** exponent for exponent in range(14))
+DEFAULT_MIN_SIZE = PAYLOAD_SIZES[0]
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+# Bytes processed per case, bounded by a call count range.
+DEFAULT_TARGET_BYTES = 64 * 1024 * 1024
+MIN_CALLS = 1
+MAX_CALLS = 10000
+
+# Large payloads are built by repeating a random block instead of reading
+# them all from the random device.
+RANDOM_BLOCK_SIZE = 1024 * 1024
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_payload(size):
+    """Return `size` bytes of random data."""
+    if size <= RANDOM_BLOCK_SIZE:
+        return os.urandom(size)
+    block = os.urandom(RANDOM_BLOCK_SIZE)
+    return (block * (size // RANDOM_BLOCK_SIZE + 1))[:size]
+
+
+def get_peak_rss():
+    """Return peak resident set size of this process in kilobytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+        # Reported in bytes on OS X.
+        return peak_rss // 1024
+    return peak_rss
+
+
+def get_percentile(sorted_values, percentile):
+    """Return the nearest-rank `percentile` of a sorted list."""
+    index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def get_cases():
+    """Yield (cipher name, mode name, cipher factory) for every cipher to run."""
+    for mode in AESCipher.SUPPORTED_MODES:
+        def new_aes_cipher(mode=mode):
+            return AESCipher(AESCipher.generate_key(), AESCipher.generate_iv(), mode)
+        yield AESCipher.__name__, MODE_NAMES[mode], new_aes_cipher
+
+    for xor_cipher in classes.ciphers.XOR_CIPHERS:
+        def new_xor_cipher(xor_cipher=xor_cipher):
+            return xor_cipher(os.urandom(16))
+        yield xor_cipher.__name__, None, new_xor_cipher
+
+
+def time_calls(function, data, calls):
+    """Call `function` with `data` `calls` times and return each call's duration."""
+    timer = timeit.default_timer
+    durations = []
+    for _ in range(calls):
+        start = timer()
+        function(data)
+        durations.append(timer() - start)
+    return durations
+
+
+def summarize(durations, size):
+    """Return throughput and latency statistics for a list of call durations."""
+    total_seconds = sum(durations)
+    sorted_durations = sorted(durations)
+    latency = dict(
+        ("p{}".format(percentile), get_percentile(sorted_durations, percentile) * 1e6)
+        for percentile in PERCENTILES
+    )
+    latency["max"] = sorted_durations[-1] * 1e6
+    return {
+        "calls": len(durations),
+        "total_seconds": total_seconds,
+        "throughput_mb_s": (
+            size * len(durations) / total_seconds / 1e6 if total_seconds else None
+        ),
+        "latency_us": latency,
+    }
+
+
+def run_case(new_cipher, encoder, size, target_bytes):
+    """Benchmark encryption and decryption of one payload size. Returns a list of
+    result dicts, one per operation. `peak_rss_kb` is the peak of the whole process
+    up to the end of the operation.
+    """
+    calls = min(MAX_CALLS, max(MIN_CALLS, target_bytes // size))
+    cipher = new_cipher()
+    cipher.set_encoding(encoder)
+
+    data = get_payload(size)
+    results = []
+    try:
+        encrypted_data = cipher.encrypt(data)
+    except Exception as e:
+        return [{"operation": "encrypt", "error": repr(e)}]
+
+    for operation, function, payload in (
+        ("encrypt", cipher.encrypt, data),
+        ("decrypt", cipher.decrypt, encrypted_data),
+    ):
+        result = {"operation": operation}
+        try:
+            result.update(summarize(time_calls(function, payload, calls), size))
+        except Exception as e:
+            result["error"] = repr(e)
+        result["peak_rss_kb"] = get_peak_rss()
+        results.append(result)
+
+    return results
+
+
+def _run_case_in_child(connection, new_cipher, encoder, size, target_bytes):
+    try:
+        connection.send(run_case(new_cipher, encoder, size, target_bytes))
+    finally:
+        connection.close()
+
+
+def run_isolated_case(new_cipher, encoder, size, target_bytes):
+    """Return `run_case` results from a forked child process, so the peak
+    resident set size reported is of this case alone.
+    """
+    parent_connection, child_connection = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_run_case_in_child,
+        args=(child_connection, new_cipher, encoder, size, target_bytes)
+    )
+    process.start()
+    child_connection.close()
+    try:
+        results = parent_connection.recv()
+    except EOFError:
+        results = None
+    finally:
+        parent_connection.close()
+        process.join()
+
+    if results is None:
+        return [{
+            "operation": "encrypt",
+            "error": "Benchmark process exited with code {}.".format(process.exitcode),
+        }]
+    return results
+
+
+def run(min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE, target_bytes=DEFAULT_TARGET_BYTES):
+    """Run every benchmark case and return a JSON serializable report."""
+    sizes = [size for size in PAYLOAD_SIZES if min_size <= size <= max_size]
+    results = []
+    for cipher_name, mode_name, new_cipher in get_cases():
+        for encoder in ENCODERS:
+            for size in sizes:
+                for result in run_isolated_case(new_cipher, encoder, size, target_bytes):
+                    result.update({
+                        "cipher": cipher_name,
+                        "mode": mode_name,
+                        "encoder": encoder.name,
+                        "size": size,
+                    })
+                    results.append(result)
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Benchmark crypto ciphers, modes and encoders."""
+    )
+
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=DEFAULT_MIN_SIZE,
+        help="Smallest payload size in bytes."
+    )
+
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help="Largest payload size in bytes. Sizes go up to {} bytes.".format(
+            PAYLOAD_SIZES[-1]
+        )
+    )
+
+    parser.add_argument(
+        "--target-bytes",
+        type=int,
+        default=DEFAULT_TARGET_BYTES,
+        help="Bytes to process per case. Determines the number of calls."
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="File to write JSON results to. Defaults to stdout."
+    )
+
+    args = parser.parse_args()
+    report = run(args.min_size, args.max_size, args.target_bytes)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,34 @@
+
+from aes import AESCipher
+from collections import OrderedDict
+
+# XOR cipher backends, fastest first. Each is only available when its
+# dependency (NumPy or Pycrypto's XOR module) can be imported.
+XOR_CIPHERS = []
+
+try:
+    from xor_numpy import NumpyXORCipher
+    XOR_CIPHERS.append(NumpyXORCipher)
+except ImportError:
+    pass
+
+try:
+    from xor import XORCipher
+    XOR_CIPHERS.append(XORCipher)
+except ImportError:
+    pass
+
+
+def get_xor_cipher():
+    """Return the fastest available XOR cipher class."""
+    if not XOR_CIPHERS:
+        raise ImportError("No XOR cipher backend is available. Install NumPy.")
+    return XOR_CIPHERS[0]
+
+
+# Ciphers selectable by name, shared by the command-line interfaces.
+CIPHERS = OrderedDict()
+if XOR_CIPHERS:
+    CIPHERS['XOR'] = get_xor_cipher()
+CIPHERS['AES'] = AESCipher
+CIPHER_DEFAULT = "XOR" if 'XOR' in CIPHERS else "AES"
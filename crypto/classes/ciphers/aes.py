@@ -1,7 +1,24 @@
 
-from base import BlockCipher
+import binascii
+
+from base import (
+    BlockCipher,
+    PADDING_RANDOM,
+    STREAM_HEADER,
+    _align_chunks,
+    _buffer,
+    _is_stream,
+    _strip_stream_header
+)
 from Crypto import Random
 from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from multiprocessing.pool import ThreadPool
+
+
+# Bytes of CTR keystream generated per worker task. Must be a multiple of the
+# AES block size.
+PARALLEL_SEGMENT_SIZE = 4 * 1024 * 1024
 
 
 class AESCipher(BlockCipher):
@@ -15,9 +32,10 @@ class AESCipher(BlockCipher):
         AES.MODE_OPENPGP
     )
 
-    def __init__(self, key=None, iv=None, mode=AES.MODE_CFB):
-        super(AESCipher, self).__init__(key, iv)
+    def __init__(self, key=None, iv=None, mode=AES.MODE_CFB, workers=1, padding=PADDING_RANDOM):
+        super(AESCipher, self).__init__(key, iv, padding)
         self._mode = mode
+        self.workers = workers
 
     @staticmethod
     def generate_iv():
@@ -60,24 +78,151 @@ class AESCipher(BlockCipher):
             raise AttributeError("AES mode not supported.")
         self._mode = value
 
-    def _get_cipher(self):
+    def _get_counter(self, block_offset=0, iv=None):
+        """Return a Pycrypto counter for CTR mode. `iv` (defaults to the cipher's
+        IV) is used as the initial 128-bit counter block, advanced by
+        `block_offset` blocks.
+        """
+        iv = self.iv if iv is None else iv
+        initial_value = int(binascii.hexlify(iv), 16) + block_offset
+        return Counter.new(
+            AES.block_size * 8,
+            initial_value=initial_value % (1 << AES.block_size * 8),
+            allow_wraparound=True
+        )
+
+    def _get_cipher(self, block_offset=0):
         """Return a Pycrypto AES cipher instance.
-        `key`, `mode` and depending on mode `iv` must be set.
+        `key`, `mode` and depending on mode `iv` must be set. `block_offset` only
+        applies to CTR mode, and positions the counter that many blocks in.
         """
-        if self.mode in (AES.MODE_ECB, AES.MODE_CTR):
+        if self.mode == AES.MODE_ECB:
             return AES.new(self.key, self.mode)
+        if self.mode == AES.MODE_CTR:
+            return AES.new(self.key, self.mode, counter=self._get_counter(block_offset))
         return AES.new(self.key, self.mode, self.iv)
 
+    def _get_cipher_factory(self):
+        """Return a callable creating a Pycrypto AES cipher instance for an IV,
+        with `key` and `mode` looked up and validated once. ECB ciphers hold no
+        state between calls and take no IV, so a single instance is shared.
+        Pycrypto binds the IV when a cipher is created, so other modes need an
+        instance per IV.
+        """
+        key = self.key
+        mode = self.mode
+        if mode == AES.MODE_ECB:
+            aes_cipher = AES.new(key, mode)
+            return lambda iv: aes_cipher
+        if mode == AES.MODE_CTR:
+            return lambda iv: AES.new(key, mode, counter=self._get_counter(iv=iv))
+        return lambda iv: AES.new(key, mode, iv)
+
+    def _ctr_crypt(self, data, segment_size=PARALLEL_SEGMENT_SIZE):
+        """Encrypt or decrypt (the same operation in CTR mode) `data`.
+        When `workers` is greater than one, `data` is split into segments that
+        are processed on a thread pool, each starting at its own counter value.
+        Pycrypto releases the GIL while encrypting, and the joined output is the
+        same as processing `data` serially.
+        """
+        if self.workers <= 1 or len(data) <= segment_size:
+            return self._get_cipher().encrypt(data)
+
+        def crypt_segment(offset):
+            aes_cipher = self._get_cipher(offset // AES.block_size)
+            return aes_cipher.encrypt(_buffer(data, offset, segment_size))
+
+        pool = ThreadPool(self.workers)
+        try:
+            segments = pool.map(crypt_segment, range(0, len(data), segment_size))
+        finally:
+            pool.close()
+            pool.join()
+
+        return b"".join(segments)
+
+    def _encrypt_chunks(self, chunks):
+        """Encrypt chunks with a single cipher, padding only the final block. The
+        ciphertext follows STREAM_HEADER.
+        """
+        aes_cipher = self._get_cipher()
+        yield STREAM_HEADER
+        last_chunk = b""
+        for chunk in _align_chunks(chunks, AES.block_size):
+            if last_chunk:
+                yield aes_cipher.encrypt(last_chunk)
+            last_chunk = chunk
+
+        padding = self.get_tail_padding(last_chunk, AES.block_size)
+        if len(padding) == AES.block_size:
+            if last_chunk:
+                yield aes_cipher.encrypt(last_chunk)
+            yield aes_cipher.encrypt(padding)
+        else:
+            yield aes_cipher.encrypt(last_chunk + padding)
+
+    def _decrypt_chunks(self, chunks):
+        """Decrypt chunks with a single cipher, holding back the final block until
+        the end of the stream so its padding can be stripped.
+        """
+        aes_cipher = self._get_cipher()
+        last_block = b""
+        for chunk in _align_chunks(_strip_stream_header(chunks), AES.block_size):
+            decrypted_data = aes_cipher.decrypt(chunk)
+            if last_block:
+                yield last_block
+            if len(decrypted_data) > AES.block_size:
+                yield decrypted_data[:-AES.block_size]
+            last_block = decrypted_data[-AES.block_size:]
+
+        if not last_block:
+            raise ValueError("Stream ends before its final block.")
+        yield self.unpad_tail(last_block)
+
     def encrypt(self, data):
         """Generate cipher, encrypt, and encode data."""
-        aes_cipher = self._get_cipher()
-        padded_data = self.pad_data(data, AES.block_size)
-        encrypted_data = aes_cipher.encrypt(padded_data)
+        padded_data = self._get_padded_data(data, AES.block_size)
+        if self.mode == AES.MODE_CTR:
+            encrypted_data = self._ctr_crypt(padded_data)
+        else:
+            encrypted_data = self._get_cipher().encrypt(padded_data)
         return self._encode(encrypted_data)
 
+    def encrypt_many(self, iterable):
+        """Return a generator that encrypts and encodes each item of `iterable`.
+        Except in ECB mode, every item is encrypted with its own random IV, which
+        precedes its ciphertext, so no two items share a keystream. The cipher's
+        `iv` is not used. IVs and padding are drawn from one buffered random
+        source, and cipher setup is shared across items.
+        """
+        new_cipher = self._get_cipher_factory()
+        iv_size = 0 if self.mode == AES.MODE_ECB else AES.block_size
+        for data in iterable:
+            iv = self._read_random(iv_size)
+            padded_data = self._get_padded_data(data, AES.block_size)
+            yield self._encode(iv + new_cipher(iv).encrypt(padded_data))
+
+    def decrypt_many(self, iterable):
+        """Return a generator that decodes and decrypts each item of `iterable`,
+        as encrypted by `encrypt_many`.
+        """
+        new_cipher = self._get_cipher_factory()
+        iv_size = 0 if self.mode == AES.MODE_ECB else AES.block_size
+        for data in iterable:
+            decoded_data = self._decode(data)
+            iv = decoded_data[:iv_size]
+            decrypted_data = new_cipher(iv).decrypt(_buffer(decoded_data, iv_size))
+            yield self.unpad_data(decrypted_data)
+
+    def _decrypt_padded(self, data):
+        """Generate cipher, decode, and decrypt data, leaving its padding."""
+        decoded_data = self._decode(data)
+        if _is_stream(decoded_data):
+            raise ValueError("Data was encrypted as a stream, use `decrypt_stream`.")
+        if self.mode == AES.MODE_CTR:
+            return self._ctr_crypt(decoded_data)
+        return self._get_cipher().decrypt(decoded_data)
+
     def decrypt(self, data):
         """Generate cipher, decode, and decrypt data."""
-        aes_cipher = self._get_cipher()
-        decoded_data = self._decode(data)
-        decrypted_data = aes_cipher.decrypt(decoded_data)
-        return self.unpad_data(decrypted_data)
+        return self.unpad_data(self._decrypt_padded(data))
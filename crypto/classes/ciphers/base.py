@@ -1,13 +1,137 @@
 
+from ..encoders import registry
+from ..encoders.base import AlignedStreamCodec, Encoder
 from Crypto import Random
+from functools import partial
+
+
+# Default number of bytes read from a source per chunk when streaming.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Number of random bytes read from the random device at a time.
+RANDOM_BUFFER_SIZE = 4096
+
+# Padding schemes for block ciphers. The random scheme prepends a random
+# character. PKCS#7 appends bytes equal to the padding length.
+PADDING_RANDOM = "random"
+PADDING_PKCS7 = "pkcs7"
+PADDING_SCHEMES = (PADDING_RANDOM, PADDING_PKCS7)
+
+# Written before the ciphertext of block cipher streams, which are always PKCS#7
+# padded, so stream and `encrypt` output cannot be mistaken for each other.
+STREAM_HEADER = b"PTCSTRM1"
+
+# Chunk alignment used to stream encoder/decoder functions that are not part of
+# an Encoder, which matches base64.
+ENCODE_BLOCK_SIZE = 3
+DECODE_BLOCK_SIZE = 4
+
+
+try:
+    _buffer = buffer
+except NameError:
+    # Python 3.
+    def _buffer(data, offset=0, size=-1):
+        view = memoryview(data)[offset:]
+        return view if size < 0 else view[:size]
+
+
+def _read_chunks(src, chunk_size):
+    """Yield chunks of at most `chunk_size` bytes from file-like `src`."""
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _align_chunks(chunks, alignment):
+    """Regroup `chunks` so every yielded chunk is a multiple of `alignment` bytes
+    long. Any remainder is yielded on its own as the final chunk.
+    """
+    remainder = b""
+    for chunk in chunks:
+        if remainder:
+            chunk = remainder + chunk
+        cut = len(chunk) - len(chunk) % alignment
+        remainder = chunk[cut:]
+        if cut:
+            yield chunk[:cut]
+
+    if remainder:
+        yield remainder
+
+
+def _get_pkcs7_padding(pad_size):
+    """Return a bytearray of PKCS#7 padding `pad_size` bytes long."""
+    return bytearray((pad_size,)) * pad_size
+
+
+def _get_pkcs7_data_size(data):
+    """Validate the PKCS#7 padding of `data` and return the size of the data
+    before it.
+    """
+    pad_size = bytearray(data[-1:])[0] if len(data) else 0
+    if not pad_size or pad_size > len(data):
+        raise ValueError("Invalid PKCS#7 padding.")
+    if bytearray(data[len(data) - pad_size:]) != _get_pkcs7_padding(pad_size):
+        raise ValueError("Invalid PKCS#7 padding.")
+    return len(data) - pad_size
+
+
+def _strip_stream_header(chunks):
+    """Verify that `chunks` start with STREAM_HEADER, and yield them without it."""
+    header = b""
+    for chunk in chunks:
+        if len(header) < len(STREAM_HEADER):
+            header += chunk
+            if len(header) < len(STREAM_HEADER):
+                continue
+            chunk = header[len(STREAM_HEADER):]
+            if header[:len(STREAM_HEADER)] != STREAM_HEADER:
+                break
+        if chunk:
+            yield chunk
+
+    if header[:len(STREAM_HEADER)] != STREAM_HEADER:
+        raise ValueError("Data was not encrypted as a stream, use `decrypt`.")
+
+
+def _is_stream(data):
+    """Return Boolean indicating if data starts with STREAM_HEADER."""
+    return bytearray(data[:len(STREAM_HEADER)]) == STREAM_HEADER
+
+
+class RandomBuffer(object):
+    """Serve random bytes from a single Pycrypto random device, reading them in
+    bulk rather than issuing a read per request.
+    """
+    def __init__(self, buffer_size=RANDOM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._random_device = Random.new()
+        self._buffer = b""
+        self._position = 0
+
+    def read(self, size):
+        """Return `size` random bytes."""
+        end = self._position + size
+        if end > len(self._buffer):
+            self._buffer = self._buffer[self._position:] + self._random_device.read(
+                max(self.buffer_size, size)
+            )
+            self._position = 0
+            end = size
+
+        data = self._buffer[self._position:end]
+        self._position = end
+        return data
 
 
 class CryptoCipher(object):
     """Base Class for Ciphers."""
     def __init__(self, key=None):
         self._key = key
-        self._encoder = None
-        self._decoder = None
+        self.set_encoding(None)
 
     def __repr__(self):
         return "{} key {} set.".format(
@@ -39,25 +163,86 @@ class CryptoCipher(object):
         else:
             return data
 
+    def _encrypt_chunks(self, chunks):
+        """Return a generator of encrypted chunks for an iterable of data chunks."""
+        raise NotImplementedError("Method not defined.")
+
+    def _decrypt_chunks(self, chunks):
+        """Return a generator of decrypted chunks for an iterable of data chunks."""
+        raise NotImplementedError("Method not defined.")
+
     def encrypt(self, data):
         raise NotImplemented("Method not defined.")
 
     def decrypt(self, data):
         raise NotImplemented("Method not defined.")
 
-    def set_encoding(self, encoder, decoder):
-        """Set encoder and decoder methods to be applied to data when encrypting
-        and decrypting.
+    def encrypt_many(self, iterable):
+        """Return a generator that encrypts and encodes each item of `iterable`."""
+        return (self.encrypt(data) for data in iterable)
+
+    def decrypt_many(self, iterable):
+        """Return a generator that decodes and decrypts each item of `iterable`."""
+        return (self.decrypt(data) for data in iterable)
+
+    def encrypt_stream(self, src, dst, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Encrypt and encode file-like `src` into file-like `dst` one chunk at a
+        time, so memory use does not depend on the size of the input.
+        """
+        stream_encoder = self._encoding.stream_encoder()
+        for chunk in self._encrypt_chunks(_read_chunks(src, chunk_size)):
+            encoded_data = stream_encoder.update(chunk)
+            if encoded_data:
+                dst.write(encoded_data)
+        dst.write(stream_encoder.finalize())
+
+    def decrypt_stream(self, src, dst, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Decode and decrypt file-like `src` into file-like `dst` one chunk at a
+        time, so memory use does not depend on the size of the input.
+        """
+        stream_decoder = self._encoding.stream_decoder()
+
+        def decode_chunks():
+            for chunk in _read_chunks(src, chunk_size):
+                decoded_data = stream_decoder.update(chunk)
+                if decoded_data:
+                    yield decoded_data
+            yield stream_decoder.finalize()
+
+        for chunk in self._decrypt_chunks(decode_chunks()):
+            dst.write(chunk)
+
+    def set_encoding(self, encoder, decoder=None):
+        """Set the encoding applied to data when encrypting and decrypting.
+        `encoder` may be the name of a registered encoding, an Encoder, or an
+        encode method to be paired with the `decoder` method.
         """
-        self._encoder = encoder
-        self._decoder = decoder
+        if encoder is None and decoder is None:
+            encoder = "NONE"
+        if isinstance(encoder, str):
+            encoder = registry.get_encoder(encoder)
+
+        if not isinstance(encoder, Encoder):
+            encoder = Encoder(
+                None,
+                encoder,
+                decoder,
+                partial(AlignedStreamCodec, encoder, ENCODE_BLOCK_SIZE),
+                partial(AlignedStreamCodec, decoder, DECODE_BLOCK_SIZE)
+            )
+
+        self._encoding = encoder
+        self._encoder = encoder.encode
+        self._decoder = encoder.decode
 
 
 class BlockCipher(CryptoCipher):
     """Base Class for Block Ciphers."""
-    def __init__(self, key=None, iv=None):
+    def __init__(self, key=None, iv=None, padding=PADDING_RANDOM):
         super(BlockCipher, self).__init__(key)
         self._iv = iv
+        self._random_buffer = None
+        self.padding = padding
 
     def __repr__(self):
         return "{} key {} set, IV {} set.".format(
@@ -76,22 +261,88 @@ class BlockCipher(CryptoCipher):
     def iv(self, value):
         self._iv = value
 
+    @property
+    def padding(self):
+        return self._padding
+
+    @padding.setter
+    def padding(self, value):
+        if value not in PADDING_SCHEMES:
+            raise AttributeError("Padding scheme not supported.")
+        self._padding = value
+
+    def _read_random(self, size):
+        """Return `size` random bytes from the cipher's buffered random source."""
+        if self._random_buffer is None:
+            self._random_buffer = RandomBuffer()
+        return self._random_buffer.read(size)
+
     def _get_pad_char(self, ignore=None):
         """Return a random character to pad data that does not match ignore."""
-        random_device = Random.new()
         while True:
-            char = random_device.read(1)
+            char = self._read_random(1)
             if char != ignore:
                 return char
 
-    def pad_data(self, data, block_size):
-        """Left pad data with a random character. Always add padding."""
+    def _get_padded_data(self, data, block_size):
+        """Return data padded according to the padding scheme, for encryption.
+        PKCS#7 padded data is copied once into a preallocated bytearray, padded in
+        place with `pad_buffer`, and returned as a read-only buffer over it.
+        """
+        if self.padding == PADDING_PKCS7:
+            pad_size = block_size - len(data) % block_size
+            padded_data = bytearray(len(data) + pad_size)
+            padded_data[:len(data)] = data
+            return self.pad_buffer(padded_data, len(data), block_size)
+
         pad_char = self._get_pad_char(ignore=data[0])
         pad_size = (block_size - len(data)) % block_size or block_size
         return (pad_char * pad_size) + data
 
+    def pad_data(self, data, block_size):
+        """Pad data according to the padding scheme. Always add padding.
+        The random scheme left pads data with a random character. The PKCS#7
+        scheme right pads data with bytes equal to the padding length.
+        """
+        return bytes(self._get_padded_data(data, block_size))
+
+    def pad_buffer(self, buffer, data_size, block_size):
+        """PKCS#7 pad, in place, the first `data_size` bytes of a preallocated
+        bytearray `buffer`. `buffer` must have room for the padding. Returns a
+        read-only buffer over the padded data, which Pycrypto accepts without
+        copying it.
+        """
+        pad_size = block_size - data_size % block_size
+        if len(buffer) < data_size + pad_size:
+            raise ValueError("Buffer is too small to hold padding.")
+        buffer[data_size:data_size + pad_size] = _get_pkcs7_padding(pad_size)
+        return _buffer(buffer, 0, data_size + pad_size)
+
     def unpad_data(self, data):
         """Strip padding from data. It is expected that the `pad_data`
         method (or equivalent) has been applied.
         """
-        return data.lstrip(data[0])
\ No newline at end of file
+        if self.padding == PADDING_PKCS7:
+            return bytes(data[:_get_pkcs7_data_size(data)])
+        return data.lstrip(data[0])
+
+    def unpad_buffer(self, data):
+        """Strip PKCS#7 padding from data by returning a read-only buffer over it
+        rather than a copy. `data` must not be modified while the buffer is used.
+        """
+        if self.padding != PADDING_PKCS7:
+            raise AttributeError("Only PKCS#7 padding can be stripped without copying.")
+        return _buffer(data, 0, _get_pkcs7_data_size(data))
+
+    def get_tail_padding(self, data, block_size):
+        """Return the padding to append to `data`, the final piece of a stream.
+        Padding is always added. Streams are PKCS#7 padded whatever the padding
+        scheme, as the random scheme's leading padding cannot be streamed.
+        """
+        return bytes(_get_pkcs7_padding(block_size - len(data) % block_size))
+
+    def unpad_tail(self, data):
+        """Strip padding from the final block of a stream. It is expected that
+        `get_tail_padding` (or equivalent) has been applied.
+        """
+        return bytes(data[:_get_pkcs7_data_size(data)])
@@ -10,6 +10,18 @@ class XORCipher(CryptoCipher):
     def __init__(self, key=None):
         super(XORCipher, self).__init__(key)
 
+    def _encrypt_chunks(self, chunks):
+        """Encrypt chunks with a single cipher, keeping the key position."""
+        xor_cipher = XOR.new(self.key)
+        for chunk in chunks:
+            yield xor_cipher.encrypt(chunk)
+
+    def _decrypt_chunks(self, chunks):
+        """Decrypt chunks with a single cipher, keeping the key position."""
+        xor_cipher = XOR.new(self.key)
+        for chunk in chunks:
+            yield xor_cipher.decrypt(chunk)
+
     def encrypt(self, data):
         """Generate cipher, encrypt, and encode data."""
         xor_cipher = XOR.new(self.key)
@@ -0,0 +1,67 @@
+
+import numpy
+
+from base import CryptoCipher
+
+
+# Minimum length the key is tiled to before XORing, so short keys still operate
+# on wide rows.
+MIN_KEY_BLOCK_SIZE = 4096
+
+
+class NumpyXORCipher(CryptoCipher):
+    """Bitwise XOR stream cipher backed by NumPy. Output matches `XORCipher`, but
+    whole buffers are XORed in one vectorised operation into a bytearray.
+    Vulnerable to frequency analysis. Appropriate for hiding data, not securing it.
+    """
+    def __init__(self, key=None):
+        super(NumpyXORCipher, self).__init__(key)
+
+    def _get_key_block(self, position=0):
+        """Return the key as a uint8 array, rotated to start `position` bytes into
+        the key and tiled to at least `MIN_KEY_BLOCK_SIZE` bytes.
+        """
+        key = numpy.frombuffer(self.key, dtype=numpy.uint8)
+        key = numpy.roll(key, -(position % len(key)))
+        return numpy.tile(key, max(1, MIN_KEY_BLOCK_SIZE // len(key)))
+
+    def _xor(self, data, position=0):
+        """Return a bytearray of `data` XORed with the key, starting `position`
+        bytes into the key. `data` may be any object supporting the buffer protocol.
+        """
+        output = bytearray(len(data))
+        if not output:
+            return output
+
+        key_block = self._get_key_block(position)
+        source = numpy.frombuffer(data, dtype=numpy.uint8)
+        target = numpy.frombuffer(output, dtype=numpy.uint8)
+
+        # XOR whole key blocks as rows of a 2D view, then the remainder.
+        whole = len(output) - len(output) % len(key_block)
+        numpy.bitwise_xor(
+            source[:whole].reshape(-1, len(key_block)),
+            key_block,
+            out=target[:whole].reshape(-1, len(key_block))
+        )
+        numpy.bitwise_xor(source[whole:], key_block[:len(output) - whole], out=target[whole:])
+        return output
+
+    def _encrypt_chunks(self, chunks):
+        """Encrypt chunks, carrying the key position between them."""
+        position = 0
+        for chunk in chunks:
+            yield self._xor(chunk, position)
+            position += len(chunk)
+
+    def _decrypt_chunks(self, chunks):
+        """Decrypt chunks, carrying the key position between them."""
+        return self._encrypt_chunks(chunks)
+
+    def encrypt(self, data):
+        """Encrypt and encode data."""
+        return self._encode(self._xor(data))
+
+    def decrypt(self, data):
+        """Decode and decrypt data."""
+        return self._xor(self._decode(data))
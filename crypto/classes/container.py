@@ -0,0 +1,222 @@
+
+import binascii
+import struct
+
+from ciphers.aes import AESCipher
+from ciphers.base import PADDING_PKCS7, _buffer
+from Crypto.Cipher import AES
+
+"""Self-describing container format for AES encrypted data, split into fixed size
+chunks that are encrypted independently so any byte range can be decrypted
+without processing the rest of the file.
+
+Layout (integers are big-endian):
+    header:  magic, version, mode, chunk size, nonce size, nonce
+    chunks:  each chunk is PKCS#7 padded and encrypted with its own IV (or CTR
+             counter start) derived from the nonce and the chunk number
+    index:   (offset, size) of every encrypted chunk
+    footer:  chunk count, plaintext size, index offset, magic
+"""
+
+MAGIC = b"PTCC"
+VERSION = 1
+
+CONTAINER_MODES = (
+    AES.MODE_CBC,
+    AES.MODE_CFB,
+    AES.MODE_CTR,
+    AES.MODE_ECB,
+    AES.MODE_OFB
+)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+HEADER = struct.Struct(">4sBBIB")
+INDEX_ENTRY = struct.Struct(">QI")
+FOOTER = struct.Struct(">IQQ4s")
+
+BLOCK_MODULUS = 1 << (AES.block_size * 8)
+
+
+def _block_to_int(block):
+    """Return a byte string interpreted as a big-endian integer."""
+    return int(binascii.hexlify(block), 16)
+
+
+def _int_to_block(value):
+    """Return an integer as an AES block sized big-endian byte string."""
+    return binascii.unhexlify("{:0{}x}".format(value % BLOCK_MODULUS, AES.block_size * 2))
+
+
+class _ContainerBase(object):
+    """Shared chunk IV derivation for container readers and writers."""
+    def __init__(self, fileobj, key, mode, chunk_size, nonce):
+        if mode not in CONTAINER_MODES:
+            raise AttributeError("AES mode not supported by containers.")
+        if chunk_size <= 0 or chunk_size % AES.block_size:
+            raise AttributeError(
+                "chunk_size must be a positive multiple of {}.".format(AES.block_size)
+            )
+
+        self.fileobj = fileobj
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.nonce = nonce
+        self._cipher = AESCipher(key, mode=mode, padding=PADDING_PKCS7)
+        self._iv_cipher = AES.new(key, AES.MODE_ECB)
+
+    def _get_chunk_iv(self, index):
+        """Return the IV for chunk `index`. In CTR mode this is the first counter
+        block, spaced so no two chunks share counter values. Other modes use the
+        encrypted nonce plus chunk number, keeping IVs unpredictable.
+        """
+        nonce = _block_to_int(self.nonce)
+        if self.mode == AES.MODE_CTR:
+            blocks_per_chunk = self.chunk_size // AES.block_size + 1
+            return _int_to_block(nonce + index * blocks_per_chunk)
+        return self._iv_cipher.encrypt(_int_to_block(nonce + index))
+
+
+class ContainerWriter(_ContainerBase):
+    """Writes data to file-like `fileobj` in the container format. Data passed to
+    `write` is buffered until a full chunk is available. `close` must be called
+    (or the writer used with the with statement) to write the final chunk and
+    the index.
+    """
+    def __init__(
+        self,
+        fileobj,
+        key,
+        mode=AES.MODE_CTR,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        nonce=None
+    ):
+        super(ContainerWriter, self).__init__(
+            fileobj,
+            key,
+            mode,
+            chunk_size,
+            nonce or AESCipher.generate_iv()
+        )
+        self._buffer = []
+        self._buffer_size = 0
+        self._index = []
+        self._size = 0
+        self._closed = False
+
+        header = HEADER.pack(MAGIC, VERSION, mode, chunk_size, len(self.nonce)) + self.nonce
+        self.fileobj.write(header)
+        self._offset = len(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def _write_chunk(self, data):
+        self._cipher.iv = self._get_chunk_iv(len(self._index))
+        encrypted_data = self._cipher.encrypt(data)
+        self.fileobj.write(encrypted_data)
+        self._index.append((self._offset, len(encrypted_data)))
+        self._offset += len(encrypted_data)
+        self._size += len(data)
+
+    def write(self, data):
+        """Buffer data, encrypting and writing every complete chunk."""
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size < self.chunk_size:
+            return
+
+        data = b"".join(self._buffer)
+        end = len(data) - len(data) % self.chunk_size
+        for start in range(0, end, self.chunk_size):
+            self._write_chunk(data[start:start + self.chunk_size])
+
+        remainder = data[end:]
+        self._buffer = [remainder]
+        self._buffer_size = len(remainder)
+
+    def close(self):
+        """Write the final chunk, the index and the footer."""
+        if self._closed:
+            return
+
+        if self._buffer_size:
+            self._write_chunk(b"".join(self._buffer))
+        self._buffer = []
+        self._buffer_size = 0
+
+        index_offset = self._offset
+        for offset, size in self._index:
+            self.fileobj.write(INDEX_ENTRY.pack(offset, size))
+        self.fileobj.write(FOOTER.pack(len(self._index), self._size, index_offset, MAGIC))
+        self._closed = True
+
+
+class ContainerReader(_ContainerBase):
+    """Reads a container from seekable file-like `fileobj`. Only the header, the
+    index and the chunks covering a requested range are read and decrypted.
+    """
+    def __init__(self, fileobj, key):
+        fileobj.seek(0)
+        magic, version, mode, chunk_size, nonce_size = HEADER.unpack(fileobj.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a container.")
+        if version != VERSION:
+            raise ValueError("Container version {} not supported.".format(version))
+
+        super(ContainerReader, self).__init__(
+            fileobj,
+            key,
+            mode,
+            chunk_size,
+            fileobj.read(nonce_size)
+        )
+
+        fileobj.seek(-FOOTER.size, 2)
+        chunk_count, self.size, index_offset, magic = FOOTER.unpack(fileobj.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError("Container footer is missing or corrupt.")
+
+        fileobj.seek(index_offset)
+        index_data = fileobj.read(chunk_count * INDEX_ENTRY.size)
+        self._index = [
+            INDEX_ENTRY.unpack_from(index_data, position)
+            for position in range(0, len(index_data), INDEX_ENTRY.size)
+        ]
+
+    def __len__(self):
+        return self.size
+
+    def _read_padded_chunk(self, index):
+        """Return the decrypted, still padded, plaintext of chunk `index`."""
+        offset, size = self._index[index]
+        self.fileobj.seek(offset)
+        self._cipher.iv = self._get_chunk_iv(index)
+        return self._cipher._decrypt_padded(self.fileobj.read(size))
+
+    def read_chunk(self, index):
+        """Return the decrypted plaintext of chunk `index`."""
+        return self._cipher.unpad_data(self._read_padded_chunk(index))
+
+    def read(self, offset=0, size=None):
+        """Return up to `size` bytes of plaintext starting at `offset`, decrypting
+        only the chunks that cover the range. Reads to the end when `size` is None.
+        """
+        end = self.size if size is None else min(self.size, offset + size)
+        if offset >= end:
+            return b""
+
+        # Copy only the requested part of each decrypted chunk into the result.
+        data = bytearray(end - offset)
+        position = 0
+        for index in range(offset // self.chunk_size, (end - 1) // self.chunk_size + 1):
+            # A view excluding the padding, so the chunk is only copied once.
+            chunk = self._cipher.unpad_buffer(self._read_padded_chunk(index))
+            start = max(0, offset - index * self.chunk_size)
+            size = min(len(chunk) - start, len(data) - position)
+            data[position:position + size] = _buffer(chunk, start, size)
+            position += size
+        return bytes(data)
@@ -2,7 +2,56 @@
 from collections import namedtuple
 
 """This is more for organization.
-Encoder namedtuples include two functions: one for encoding data and another for decoding.
+Encoder namedtuples include a name, two functions: one for encoding data and
+another for decoding, and two factories returning incremental codec objects for
+encoding and decoding streams.
+
+Incremental codecs take data through `update`, which returns whatever can be
+encoded or decoded so far, and `finalize`, which returns the rest.
 """
 
-Encoder = namedtuple('Encoder', ('encode', 'decode'))
+Encoder = namedtuple(
+    'Encoder',
+    ('name', 'encode', 'decode', 'stream_encoder', 'stream_decoder')
+)
+
+
+def to_bytes(data):
+    """Return a byte string copy of any buffer, including memoryviews."""
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+
+class AlignedStreamCodec(object):
+    """Incremental codec for functions that encode or decode independent blocks
+    of `block_size` bytes, such as base64 (3 bytes in, 4 out). Aligned data is
+    sliced rather than copied, so memoryviews pass through to `function`.
+    """
+    def __init__(self, function, block_size):
+        self.function = function
+        self.block_size = block_size
+        self._remainder = b""
+
+    def update(self, data):
+        if self._remainder:
+            data = self._remainder + to_bytes(data)
+        cut = len(data) - len(data) % self.block_size
+        self._remainder = to_bytes(data[cut:])
+        if not cut:
+            return b""
+        return self.function(data[:cut] if cut < len(data) else data)
+
+    def finalize(self):
+        remainder = self._remainder
+        self._remainder = b""
+        return self.function(remainder) if remainder else b""
+
+
+class IdentityStreamCodec(object):
+    """Incremental codec that returns data unchanged."""
+    def update(self, data):
+        return data
+
+    def finalize(self):
+        return b""
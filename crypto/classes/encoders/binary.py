@@ -1,8 +1,213 @@
 
 import base64
+import struct
 
-from base import Encoder
+from base import AlignedStreamCodec, Encoder, IdentityStreamCodec, to_bytes
+from functools import partial
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-Base64Encoder = Encoder('Base64Encoder', base64.b64encode, base64.b64decode)
-URLSafeBase64Encoder = Encoder('URLSafeBase64Encoder', base64.urlsafe_b64encode, base64.urlsafe_b64decode)
+
+# Length prefix of framed data.
+FRAME_HEADER = struct.Struct(">I")
+
+# RFC 1924 base85 alphabet, and every pair of its characters so a word is
+# encoded with three lookups. Decoding looks up each character's value times
+# the weight of its position in a word.
+B85_ALPHABET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~"
+B85_CHARS = [B85_ALPHABET[index:index + 1] for index in range(85)]
+B85_PAIRS = [first + second for first in B85_CHARS for second in B85_CHARS]
+B85_DECODE_TABLES = []
+for _weight in (85 ** 4, 85 ** 3, 85 ** 2, 85, 1):
+    _table = [0] * 256
+    for _value, _char in enumerate(bytearray(B85_ALPHABET)):
+        _table[_char] = _value * _weight
+    B85_DECODE_TABLES.append(_table)
+del _weight, _table, _value, _char
+
+if numpy is not None:
+    B85_ALPHABET_ARRAY = numpy.frombuffer(B85_ALPHABET, dtype=numpy.uint8)
+    B85_VALUES = numpy.full(256, 255, dtype=numpy.uint8)
+    B85_VALUES[B85_ALPHABET_ARRAY] = numpy.arange(85, dtype=numpy.uint8)
+    B85_WEIGHTS = numpy.array([85 ** 4, 85 ** 3, 85 ** 2, 85, 1], dtype=numpy.uint64)
+
+
+def _urlsafe_b64decode(data):
+    """base64.urlsafe_b64decode that also accepts memoryviews."""
+    return base64.urlsafe_b64decode(to_bytes(data))
+
+
+def _b85encode(data):
+    """Return data encoded with the RFC 1924 base85 alphabet, as
+    base64.b85encode does in Python 3.4+. All words are unpacked at once.
+    """
+    data = to_bytes(data)
+    padding = -len(data) % 4
+    if padding:
+        data += b"\0" * padding
+
+    pairs = B85_PAIRS
+    chars = B85_CHARS
+    encoded = b"".join([
+        pairs[word // 614125] + pairs[word // 85 % 7225] + chars[word % 85]
+        for word in struct.unpack(">{}I".format(len(data) // 4), data)
+    ])
+    return encoded[:len(encoded) - padding]
+
+
+def _b85decode(data):
+    """Return data decoded from the RFC 1924 base85 alphabet, as
+    base64.b85decode does in Python 3.4+. All words are packed at once.
+    """
+    data = bytearray(to_bytes(data))
+    padding = -len(data) % 5
+    data.extend(b"~" * padding)
+
+    invalid = data.translate(None, B85_ALPHABET)
+    if invalid:
+        raise ValueError("Bad base85 character at position {}.".format(data.index(invalid[:1])))
+
+    first, second, third, fourth, fifth = B85_DECODE_TABLES
+    words = [
+        first[a] + second[b] + third[c] + fourth[d] + fifth[e]
+        for a, b, c, d, e in zip(data[0::5], data[1::5], data[2::5], data[3::5], data[4::5])
+    ]
+    if words and max(words) > 0xffffffff:
+        overflow = next(index for index, word in enumerate(words) if word > 0xffffffff)
+        raise ValueError("base85 overflow in hunk starting at byte {}.".format(overflow * 5))
+
+    decoded = struct.pack(">{}I".format(len(words)), *words)
+    return decoded[:len(decoded) - padding]
+
+
+def _b85encode_numpy(data):
+    """_b85encode, computing every word's digits at once with NumPy."""
+    data = to_bytes(data)
+    padding = -len(data) % 4
+    if padding:
+        data += b"\0" * padding
+
+    words = numpy.frombuffer(data, dtype=">u4").astype(numpy.uint32)
+    digits = numpy.empty((len(words), 5), dtype=numpy.uint8)
+    for index in range(4, -1, -1):
+        words, digits[:, index] = numpy.divmod(words, 85)
+
+    encoded = B85_ALPHABET_ARRAY[digits].tobytes()
+    return encoded[:len(encoded) - padding]
+
+
+def _b85decode_numpy(data):
+    """_b85decode, computing every word at once with NumPy."""
+    data = bytearray(to_bytes(data))
+    padding = -len(data) % 5
+    data.extend(b"~" * padding)
+
+    values = B85_VALUES[numpy.frombuffer(data, dtype=numpy.uint8)]
+    invalid = numpy.flatnonzero(values == 255)
+    if len(invalid):
+        raise ValueError("Bad base85 character at position {}.".format(invalid[0]))
+
+    words = values.reshape(-1, 5).astype(numpy.uint64).dot(B85_WEIGHTS)
+    overflow = numpy.flatnonzero(words > 0xffffffff)
+    if len(overflow):
+        raise ValueError("base85 overflow in hunk starting at byte {}.".format(overflow[0] * 5))
+
+    decoded = words.astype(">u4").tobytes()
+    return decoded[:len(decoded) - padding]
+
+
+def frame_encode(data):
+    """Return data as a single length-prefixed frame."""
+    return FRAME_HEADER.pack(len(data)) + to_bytes(data)
+
+
+def frame_decode(data):
+    """Return the joined payloads of consecutive length-prefixed frames."""
+    decoder = FramedStreamDecoder()
+    payload = decoder.update(data)
+    return payload + decoder.finalize()
+
+
+class FramedStreamEncoder(object):
+    """Incremental codec writing each piece of data as its own frame."""
+    def update(self, data):
+        return frame_encode(data) if len(data) else b""
+
+    def finalize(self):
+        return b""
+
+
+class FramedStreamDecoder(object):
+    """Incremental codec returning the payloads of complete frames, buffering any
+    partial frame until the rest arrives.
+    """
+    def __init__(self):
+        self._buffer = b""
+
+    def update(self, data):
+        buffer = self._buffer + to_bytes(data) if self._buffer else memoryview(data)
+        payloads = []
+        position = 0
+        while len(buffer) - position >= FRAME_HEADER.size:
+            size, = FRAME_HEADER.unpack_from(buffer, position)
+            end = position + FRAME_HEADER.size + size
+            if end > len(buffer):
+                break
+            payloads.append(to_bytes(buffer[position + FRAME_HEADER.size:end]))
+            position = end
+
+        self._buffer = to_bytes(buffer[position:])
+        return b"".join(payloads)
+
+    def finalize(self):
+        if self._buffer:
+            raise ValueError("Framed data ends with an incomplete frame.")
+        return b""
+
+
+Base64Encoder = Encoder(
+    'BASE64',
+    base64.b64encode,
+    base64.b64decode,
+    partial(AlignedStreamCodec, base64.b64encode, 3),
+    partial(AlignedStreamCodec, base64.b64decode, 4)
+)
+
+URLSafeBase64Encoder = Encoder(
+    'URLSAFE_BASE64',
+    base64.urlsafe_b64encode,
+    _urlsafe_b64decode,
+    partial(AlignedStreamCodec, base64.urlsafe_b64encode, 3),
+    partial(AlignedStreamCodec, _urlsafe_b64decode, 4)
+)
+
+# Base85 is denser than base64 (4 bytes in, 5 out). It is vectorised with NumPy
+# when available. Otherwise Python 3.4+ provides it in base64, and the equivalent
+# implementation above is used on older versions.
+if numpy is not None:
+    b85encode = _b85encode_numpy
+    b85decode = _b85decode_numpy
+else:
+    b85encode = getattr(base64, 'b85encode', _b85encode)
+    b85decode = getattr(base64, 'b85decode', _b85decode)
+
+Base85Encoder = Encoder(
+    'BASE85',
+    b85encode,
+    b85decode,
+    partial(AlignedStreamCodec, b85encode, 4),
+    partial(AlignedStreamCodec, b85decode, 5)
+)
+
+FramedEncoder = Encoder(
+    'FRAMED',
+    frame_encode,
+    frame_decode,
+    FramedStreamEncoder,
+    FramedStreamDecoder
+)
+
+NoneEncoder = Encoder('NONE', None, None, IdentityStreamCodec, IdentityStreamCodec)
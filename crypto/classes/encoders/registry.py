@@ -0,0 +1,37 @@
+
+from binary import (
+    Base64Encoder,
+    Base85Encoder,
+    FramedEncoder,
+    NoneEncoder,
+    URLSafeBase64Encoder
+)
+from collections import OrderedDict
+
+"""Registry of encoders, keyed by upper case name. Shared by the command-line
+interface and `CryptoCipher.set_encoding`.
+"""
+
+ENCODERS = OrderedDict()
+
+
+def register_encoder(encoder):
+    """Register an Encoder under its name, replacing any with the same name."""
+    ENCODERS[encoder.name.upper()] = encoder
+
+
+def get_encoder(name):
+    """Return the Encoder registered as `name`."""
+    try:
+        return ENCODERS[name.upper()]
+    except KeyError:
+        raise AttributeError("Encoding {} not supported.".format(name))
+
+
+def get_encoder_choices():
+    """Return the names of all registered encoders."""
+    return list(ENCODERS)
+
+
+for encoder in (Base64Encoder, URLSafeBase64Encoder, Base85Encoder, FramedEncoder, NoneEncoder):
+    register_encoder(encoder)
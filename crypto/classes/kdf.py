@@ -0,0 +1,196 @@
+
+import hashlib
+import threading
+import timeit
+
+from collections import OrderedDict
+from Crypto import Random
+from Crypto.Hash import HMAC, SHA256
+from Crypto.Protocol.KDF import PBKDF2
+
+try:
+    from Crypto.Protocol.KDF import scrypt as _scrypt
+except ImportError:
+    _scrypt = None
+
+"""Derive cipher keys from passphrases. Derivation is deliberately slow, so
+derived keys are kept in a bounded LRU cache keyed by a hash of the passphrase,
+the salt and the work factor parameters.
+"""
+
+KDF_PBKDF2 = "pbkdf2"
+KDF_SCRYPT = "scrypt"
+KDF_CHOICES = (KDF_PBKDF2, KDF_SCRYPT)
+
+DEFAULT_KEY_SIZE = 32
+DEFAULT_SALT_SIZE = 16
+DEFAULT_CACHE_SIZE = 128
+
+# PBKDF2-HMAC-SHA256 iteration count.
+DEFAULT_ITERATIONS = 100000
+
+# scrypt cost parameters. Memory use is roughly 128 * n * r bytes.
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+
+# Calibration bounds.
+DEFAULT_TARGET_SECONDS = 0.1
+DEFAULT_MAX_MEMORY = 64 * 1024 * 1024
+CALIBRATION_ITERATIONS = 1000
+MIN_ITERATIONS = 1000
+MIN_SCRYPT_N = 2 ** 10
+
+
+def _pbkdf2_prf(password, salt):
+    """HMAC-SHA256 pseudorandom function for PBKDF2."""
+    return HMAC.new(password, salt, SHA256).digest()
+
+
+def _get_scrypt_memory(n, r):
+    """Return the approximate number of bytes scrypt uses for `n` and `r`."""
+    return 128 * n * r
+
+
+def scrypt_available():
+    """Return Boolean indicating if an scrypt implementation is available."""
+    return _scrypt is not None or hasattr(hashlib, "scrypt")
+
+
+class KeyDeriver(object):
+    """Derives keys of `key_size` bytes from passphrases with PBKDF2-HMAC-SHA256
+    or scrypt. `iterations` is the PBKDF2 work factor, `n`, `r` and `p` are the
+    scrypt work factors. Up to `cache_size` derived keys are cached.
+    """
+    def __init__(
+        self,
+        algorithm=KDF_PBKDF2,
+        key_size=DEFAULT_KEY_SIZE,
+        iterations=DEFAULT_ITERATIONS,
+        n=DEFAULT_SCRYPT_N,
+        r=DEFAULT_SCRYPT_R,
+        p=DEFAULT_SCRYPT_P,
+        cache_size=DEFAULT_CACHE_SIZE
+    ):
+        if algorithm not in KDF_CHOICES:
+            raise AttributeError("KDF algorithm not supported.")
+        if algorithm == KDF_SCRYPT and not scrypt_available():
+            raise AttributeError("scrypt is not available.")
+
+        self.algorithm = algorithm
+        self.key_size = key_size
+        self.iterations = iterations
+        self.n = n
+        self.r = r
+        self.p = p
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "{} {} {}.".format(self.__class__, self.algorithm, self.params)
+
+    @staticmethod
+    def generate_salt(salt_size=DEFAULT_SALT_SIZE):
+        """Randomly generate a salt of byte size `salt_size`."""
+        return Random.new().read(salt_size)
+
+    @property
+    def params(self):
+        """Tuple of the parameters that determine a derived key."""
+        if self.algorithm == KDF_SCRYPT:
+            return (self.algorithm, self.key_size, self.n, self.r, self.p)
+        return (self.algorithm, self.key_size, self.iterations)
+
+    @property
+    def memory_cost(self):
+        """Approximate number of bytes used by a single derivation."""
+        if self.algorithm == KDF_SCRYPT:
+            return _get_scrypt_memory(self.n, self.r) * self.p
+        return 0
+
+    def _derive(self, passphrase, salt):
+        if self.algorithm == KDF_PBKDF2:
+            if hasattr(hashlib, "pbkdf2_hmac"):
+                # Implemented in C, several times faster than Pycrypto's PBKDF2.
+                return hashlib.pbkdf2_hmac(
+                    "sha256",
+                    passphrase,
+                    salt,
+                    self.iterations,
+                    self.key_size
+                )
+            return PBKDF2(passphrase, salt, self.key_size, self.iterations, _pbkdf2_prf)
+        if _scrypt is not None:
+            return _scrypt(passphrase, salt, self.key_size, self.n, self.r, self.p)
+        return hashlib.scrypt(
+            passphrase,
+            salt=salt,
+            n=self.n,
+            r=self.r,
+            p=self.p,
+            maxmem=2 * self.memory_cost,
+            dklen=self.key_size
+        )
+
+    def derive(self, passphrase, salt):
+        """Return the key derived from `passphrase` and `salt`, from the cache when
+        it has already been derived. The passphrase itself is not stored.
+        """
+        cache_key = (hashlib.sha256(passphrase).digest(), salt, self.params)
+        with self._lock:
+            key = self._cache.pop(cache_key, None)
+            if key is not None:
+                self._cache[cache_key] = key
+                return key
+
+        key = self._derive(passphrase, salt)
+
+        with self._lock:
+            self._cache[cache_key] = key
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return key
+
+    def clear_cache(self):
+        """Remove all derived keys from the cache."""
+        with self._lock:
+            self._cache.clear()
+
+
+def _time_derivation(key_deriver):
+    """Return the number of seconds a single uncached derivation takes."""
+    salt = KeyDeriver.generate_salt()
+    start = timeit.default_timer()
+    key_deriver._derive(b"calibration", salt)
+    return timeit.default_timer() - start
+
+
+def calibrate(
+    algorithm=KDF_PBKDF2,
+    target_seconds=DEFAULT_TARGET_SECONDS,
+    max_memory=DEFAULT_MAX_MEMORY,
+    **kwargs
+):
+    """Return a KeyDeriver whose work factor makes a derivation take about
+    `target_seconds` on this machine. scrypt's `n` is also bounded so a derivation
+    uses no more than `max_memory` bytes. Other keyword arguments are passed to
+    KeyDeriver.
+    """
+    if algorithm == KDF_PBKDF2:
+        key_deriver = KeyDeriver(algorithm, iterations=CALIBRATION_ITERATIONS, **kwargs)
+        elapsed = _time_derivation(key_deriver)
+        key_deriver.iterations = max(
+            MIN_ITERATIONS,
+            int(CALIBRATION_ITERATIONS * target_seconds / elapsed)
+        )
+        return key_deriver
+
+    # scrypt time and memory scale with n, which must be a power of two.
+    key_deriver = KeyDeriver(algorithm, n=MIN_SCRYPT_N, **kwargs)
+    while _get_scrypt_memory(key_deriver.n * 2, key_deriver.r) <= max_memory:
+        if _time_derivation(key_deriver) * 2 > target_seconds:
+            break
+        key_deriver.n *= 2
+    return key_deriver
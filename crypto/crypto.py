@@ -1,32 +1,66 @@
 
 import argparse
 import atexit
-import base64
+import binascii
 import getpass
+import io
+import mmap
 import os
 import platform
 import subprocess
+import sys
 
 import classes.ciphers
+import classes.kdf
+
+from classes.ciphers.base import _buffer
+from interfaces.commandline import argparser
 
 from Crypto.Cipher import AES
 from Crypto.Random import random
 
 
 # Constants.
-CIPHERS = {
-    'XOR': classes.ciphers.XORCipher,
-    'AES': classes.ciphers.AESCipher
-}
-CIPHER_CHOICES = CIPHERS.keys()
-CIPHER_DEFAULT = "XOR"
-
-ENCODINGS = {
-    'BASE64': (base64.b64encode, base64.b64decode),
-    'NONE': (None, None),
-}
-ENCODING_CHOICES = ENCODINGS.keys()
-ENCODING_DEFAULT = "base64"
+CIPHERS = classes.ciphers.CIPHERS
+
+# Bytes handed to the cipher per chunk when processing files.
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class MappedFileWriter(object):
+    """File-like object writing to a memory-mapped file. The mapping grows as data
+    is written, and the file is truncated to the number of bytes written on close.
+    """
+    def __init__(self, path, size_hint=0):
+        self._file = open(path, "w+b")
+        self._size = max(size_hint, mmap.PAGESIZE)
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def write(self, data):
+        """Write any object supporting the buffer protocol, e.g. a bytearray."""
+        end = self._map.tell() + len(data)
+        if end > self._size:
+            self._size = max(end, self._size * 2)
+            self._map.resize(self._size)
+        # mmap.write only takes strings and read-only buffers on Python 2.
+        self._map.write(_buffer(data))
+
+    def close(self):
+        if self._map is None:
+            return
+        size = self._map.tell()
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(size)
+        self._file.close()
 
 
 # Methods for command-line use.
@@ -60,11 +94,42 @@ def get_data_from_clipboard():
     return stdout.decode('utf-8')
 
 
+def get_mapped_input(path):
+    """Return a read-only memory map of the file at `path`."""
+    with open(path, "rb") as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            return io.BytesIO()
+        return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def get_key():
     """Get and return key using getpass."""
     return getpass.getpass("Please enter key: ")
 
 
+def process_file(cipher, in_path, out_path=None, decrypt=False):
+    """Encrypt or decrypt the file at `in_path` chunk by chunk through memory maps.
+    Results are written to `out_path`, or stdout when not provided.
+    """
+    mapped_input = get_mapped_input(in_path)
+    if out_path:
+        size_hint = os.path.getsize(in_path)
+        output = MappedFileWriter(out_path, size_hint=size_hint)
+    else:
+        output = sys.stdout
+
+    try:
+        if decrypt:
+            cipher.decrypt_stream(mapped_input, output, FILE_CHUNK_SIZE)
+        else:
+            cipher.encrypt_stream(mapped_input, output, FILE_CHUNK_SIZE)
+    finally:
+        mapped_input.close()
+        if out_path:
+            output.close()
+
+
 def store_data_in_clipboard(data):
     """Store data in clipboard."""
     process = subprocess.Popen(['pbcopy'], stdin=subprocess.PIPE)
@@ -77,59 +142,8 @@ if __name__ == "__main__":
         description="""Commandline tool for encrypting/decrypting data."""
     )
 
-    parser.add_argument(
-        "--clipboard",
-        "-c",
-        action="store_true",
-        help="Data is pulled/stored in clipboard."
-    )
-
-    parser.add_argument(
-        "--clear-on-exit",
-        "-C",
-        action="store_true",
-        help="When True will clear the screen when script completes."
-    )
-
-    parser.add_argument(
-        "--data",
-        "-d",
-        help="Raw data to encrypt or decrypt. If not provided will be prompted."
-    )
-
-    parser.add_argument(
-        "--decrypt",
-        "-D",
-        action="store_true",
-        default=False,
-        help="When True will decrypt data. When False will encrypt data."
-    )
-
-    parser.add_argument(
-        "--encoding",
-        "-e",
-        choices=ENCODING_CHOICES,
-        default=ENCODING_DEFAULT,
-        help="Encoding to apply to encrypted data or data when decrypting. Choices:{}".format(
-            ENCODING_CHOICES
-        ),
-        type=str.upper
-    )
-
-    parser.add_argument(
-        "--key",
-        "-k",
-        help="Key used to encrypt or decrypt. If not provided will be prompted."
-    )
-
-    parser.add_argument(
-        "--mode",
-        "-m",
-        choices=CIPHER_CHOICES,
-        default=CIPHER_DEFAULT,
-        help="Cipher to execute. Choices:{}".format(CIPHER_CHOICES),
-        type=str.upper
-    )
+    argparser.add_io_args(parser)
+    argparser.add_cipher_args(parser)
 
     args = parser.parse_args()
 
@@ -137,32 +151,60 @@ if __name__ == "__main__":
     if args.clear_on_exit:
         atexit.register(clear_screen)
 
+    if args.out_file and not args.in_file:
+        parser.error("--out requires --in.")
+
+    if args.clipboard and args.in_file:
+        parser.error("--clipboard cannot be used with --in.")
+
     if args.clipboard:
         args.data = get_data_from_clipboard()
 
-    if args.data is None:
+    if args.data is None and not args.in_file:
         args.data = get_data()
 
     if args.key is None:
         args.key = get_key()
 
+    if args.kdf:
+        if args.salt is None:
+            if args.decrypt:
+                parser.error("--salt is required to decrypt with --kdf.")
+            args.salt = binascii.hexlify(classes.kdf.KeyDeriver.generate_salt())
+            sys.stderr.write("SALT: {}\n".format(args.salt))
+
+        key_deriver = classes.kdf.KeyDeriver(args.kdf)
+        args.key = key_deriver.derive(args.key, binascii.unhexlify(args.salt))
+
     # Perform encryption/decryption.
     cipher = CIPHERS[args.mode](args.key)
 
-    if args.encoding:
-        cipher.set_encoding(*ENCODINGS[args.encoding])
+    if isinstance(cipher, classes.ciphers.AESCipher):
+        if args.iv is None:
+            if args.decrypt:
+                parser.error("--iv is required to decrypt with AES.")
+            args.iv = binascii.hexlify(cipher.generate_iv())
+            sys.stderr.write("IV: {}\n".format(args.iv))
 
-    if args.decrypt:
-        response = cipher.decrypt(args.data)
-    else:
-        response = cipher.encrypt(args.data)
+        cipher.iv = binascii.unhexlify(args.iv)
 
-    # Store results.
-    if args.clipboard:
-        store_data_in_clipboard(response)
-        print("\nRESPONSE has been stored in clipboard.\n\n")
+    if args.encoding:
+        cipher.set_encoding(args.encoding)
+
+    if args.in_file:
+        process_file(cipher, args.in_file, args.out_file, decrypt=args.decrypt)
     else:
-        print("\nRESPONSE:\n\n{}".format(response))
+        if args.decrypt:
+            response = cipher.decrypt(args.data)
+        else:
+            response = cipher.encrypt(args.data)
+
+        # Store results.
+        if args.clipboard:
+            store_data_in_clipboard(response)
+            print("\nRESPONSE has been stored in clipboard.\n\n")
+        else:
+            print("\nRESPONSE:\n\n{}".format(response))
 
     # Require user acknowledgement before screen clear.
     if args.clear_on_exit:
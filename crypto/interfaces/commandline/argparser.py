@@ -1,6 +1,16 @@
 
 import argparse
 
+from classes.ciphers import CIPHER_DEFAULT, CIPHERS
+from classes.encoders.registry import get_encoder_choices
+from classes.kdf import KDF_CHOICES
+
+
+CIPHER_CHOICES = list(CIPHERS)
+
+ENCODING_CHOICES = get_encoder_choices()
+ENCODING_DEFAULT = "BASE64"
+
 
 def add_io_args(parser):
     """Add standard I/O arguments to ArgumentParser."""
@@ -18,6 +28,20 @@ def add_io_args(parser):
         help="When True will clear the screen when script completes."
     )
 
+    parser.add_argument(
+        "--in",
+        "-i",
+        dest="in_file",
+        help="File to encrypt or decrypt. Read through a memory map instead of --data."
+    )
+
+    parser.add_argument(
+        "--out",
+        "-o",
+        dest="out_file",
+        help="File to write results to through a memory map. Requires --in."
+    )
+
 
 def add_cipher_args(parser):
     """Add cipher specific arguments to ArgumentParser."""
@@ -52,6 +76,25 @@ def add_cipher_args(parser):
         help="Key used to encrypt or decrypt. If not provided will be prompted."
     )
 
+    parser.add_argument(
+        "--kdf",
+        choices=KDF_CHOICES,
+        help="Derive the cipher key from the provided key (a passphrase). Choices:{}".format(
+            KDF_CHOICES
+        ),
+        type=str.lower
+    )
+
+    parser.add_argument(
+        "--salt",
+        help="Hex encoded salt for --kdf. Generated and printed when encrypting if not provided."
+    )
+
+    parser.add_argument(
+        "--iv",
+        help="Hex encoded IV for AES. Generated and printed when encrypting if not provided."
+    )
+
     parser.add_argument(
         "--mode",
         "-m",
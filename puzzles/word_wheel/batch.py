@@ -0,0 +1,265 @@
+
+"""Batch generation of word wheel puzzle packs. Candidate wheels are enumerated
+or sampled, solved in parallel across a process pool sharing one read-only
+dictionary, scored by their solution length histogram, and the wheels meeting
+the difficulty targets are streamed out as JSON lines.
+
+    python batch.py words.idx --count 10000 --min-solutions 20 --max-solutions 60
+
+A compiled index (see solver.py) is memory-mapped, so every worker shares the
+same page cache. A plain word list is loaded once before the workers fork.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import string
+import struct
+import sys
+
+from dawg import DawgIndex
+from functools import partial
+from solver import CompiledWordIndex, WordIndex
+from word_wheel import Wheel
+
+
+DEFAULT_ALPHABET = string.ascii_uppercase
+DEFAULT_WHEEL_SIZE = 9
+DEFAULT_MIN_LENGTH = 4
+DEFAULT_CHUNK_SIZE = 64
+
+# Wheels are handed to the pool in slices of this many chunks per worker, so an
+# enumeration of millions of wheels is not queued all at once.
+CHUNKS_PER_WORKER = 8
+
+# Solver backends for plain word lists.
+BACKENDS = {
+    "signature": WordIndex,
+    "dawg": DawgIndex,
+}
+DEFAULT_BACKEND = "signature"
+
+# Dictionary used by solve workers. Set in the parent before the pool forks, or
+# by `_init_worker` on platforms that spawn workers.
+_word_index = None
+
+
+def load_word_index(path, backend=DEFAULT_BACKEND):
+    """Return a CompiledWordIndex for a compiled index file, or a `backend` index
+    of a plain word list.
+    """
+    try:
+        return CompiledWordIndex(path)
+    except (ValueError, struct.error):
+        return BACKENDS[backend].from_file(path)
+
+
+def _init_worker(path, backend):
+    global _word_index
+    if _word_index is None:
+        _word_index = load_word_index(path, backend)
+
+
+def enumerate_wheels(alphabet=DEFAULT_ALPHABET, size=DEFAULT_WHEEL_SIZE):
+    """Yield (center choice, choices) for every set of `size` distinct letters of
+    `alphabet`, with each letter of the set as the center.
+    """
+    for letters in itertools.combinations(sorted(set(alphabet)), size):
+        for index, center_choice in enumerate(letters):
+            yield center_choice, letters[:index] + letters[index + 1:]
+
+
+def sample_wheels(count, alphabet=DEFAULT_ALPHABET, size=DEFAULT_WHEEL_SIZE, seed=None):
+    """Yield `count` random (center choice, choices) wheels of `size` letters drawn
+    from `alphabet`. Letters repeated in `alphabet` are proportionally more likely.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        letters = rng.sample(alphabet, size)
+        yield letters[0], tuple(letters[1:])
+
+
+def evaluate_wheel(letters, min_length=DEFAULT_MIN_LENGTH, include_words=False):
+    """Solve a (center choice, choices) wheel with the worker's dictionary. Return
+    a dict of the wheel, its solution length histogram (of solutions at least
+    `min_length` long), solution count and score. Longer words score higher.
+    """
+    center_choice, choices = letters
+    wheel = Wheel(center_choice, choices)
+    _word_index.solve(wheel)
+
+    histogram = dict(
+        (size, len(solutions))
+        for size, solutions in wheel.get_solution_count().items()
+        if size >= min_length
+    )
+    result = {
+        "center_choice": wheel.center_choice,
+        "choices": "".join(wheel.choices[:-1]),
+        "histogram": histogram,
+        "solution_count": sum(histogram.values()),
+        "score": sum(count * (size - min_length + 1) for size, count in histogram.items()),
+    }
+    if include_words:
+        result["solutions"] = sorted(
+            (solution for solution in wheel.solutions if len(solution) >= min_length),
+            key=lambda solution: (len(solution), solution)
+        )
+    return result
+
+
+def meets_targets(result, min_solutions=0, max_solutions=None, require_full_word=False):
+    """Return Boolean indicating if an `evaluate_wheel` result meets the targets.
+    `require_full_word` requires a solution using every letter of the wheel.
+    """
+    if result["solution_count"] < min_solutions:
+        return False
+    if max_solutions is not None and result["solution_count"] > max_solutions:
+        return False
+    if require_full_word:
+        return len(result["choices"]) + 1 in result["histogram"]
+    return True
+
+
+def solve_wheels(
+    index_path,
+    wheels,
+    workers=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    min_length=DEFAULT_MIN_LENGTH,
+    include_words=False,
+    backend=DEFAULT_BACKEND
+):
+    """Yield `evaluate_wheel` results for an iterable of wheels, in completion
+    order, solving them across `workers` processes (defaults to the CPU count).
+    Wheels are consumed a bounded slice at a time, so memory use does not grow
+    with the number of wheels.
+    """
+    global _word_index
+    _word_index = load_word_index(index_path, backend)
+    evaluate = partial(evaluate_wheel, min_length=min_length, include_words=include_words)
+
+    if workers == 1:
+        for letters in wheels:
+            yield evaluate(letters)
+        return
+
+    workers = workers or multiprocessing.cpu_count()
+    slice_size = chunk_size * workers * CHUNKS_PER_WORKER
+    wheels = iter(wheels)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(index_path, backend))
+    try:
+        while True:
+            # Pool reads its input eagerly, so only ever give it one slice.
+            wheel_slice = list(itertools.islice(wheels, slice_size))
+            if not wheel_slice:
+                break
+            for result in pool.imap_unordered(evaluate, wheel_slice, chunk_size):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Generate word wheels in bulk and keep those meeting difficulty targets."""
+    )
+
+    parser.add_argument("index", help="Compiled index or word list file.")
+
+    parser.add_argument(
+        "--alphabet",
+        default=DEFAULT_ALPHABET,
+        help="Letters wheels are drawn from. Repeat letters to weight sampling.",
+        type=str.upper
+    )
+
+    parser.add_argument(
+        "--count",
+        "-n",
+        type=int,
+        help="Number of wheels to sample. Enumerates every wheel when not provided."
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed used when sampling."
+    )
+
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=DEFAULT_WHEEL_SIZE,
+        help="Number of letters per wheel, including the center."
+    )
+
+    parser.add_argument(
+        "--min-length",
+        type=int,
+        default=DEFAULT_MIN_LENGTH,
+        help="Shortest solution counted towards targets and scores."
+    )
+
+    parser.add_argument(
+        "--min-solutions",
+        type=int,
+        default=0,
+        help="Fewest solutions an accepted wheel may have."
+    )
+
+    parser.add_argument(
+        "--max-solutions",
+        type=int,
+        help="Most solutions an accepted wheel may have."
+    )
+
+    parser.add_argument(
+        "--require-full-word",
+        action="store_true",
+        help="Only accept wheels with a solution using every letter."
+    )
+
+    parser.add_argument(
+        "--include-words",
+        action="store_true",
+        help="Include solutions in the output."
+    )
+
+    parser.add_argument(
+        "--backend",
+        "-b",
+        choices=sorted(BACKENDS),
+        default=DEFAULT_BACKEND,
+        help="Solver used for plain word lists. Choices:{}".format(sorted(BACKENDS))
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of worker processes. Defaults to the CPU count."
+    )
+
+    args = parser.parse_args()
+
+    if args.count is None:
+        wheels = enumerate_wheels(args.alphabet, args.size)
+    else:
+        wheels = sample_wheels(args.count, args.alphabet, args.size, args.seed)
+
+    results = solve_wheels(
+        args.index,
+        wheels,
+        workers=args.workers,
+        min_length=args.min_length,
+        include_words=args.include_words,
+        backend=args.backend
+    )
+    for result in results:
+        if meets_targets(result, args.min_solutions, args.max_solutions, args.require_full_word):
+            sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+            sys.stdout.flush()
@@ -0,0 +1,110 @@
+
+"""DAWG backed solver for word wheels (see word_wheel.py). The dictionary is
+built into a trie and then minimized into a directed acyclic word graph, so
+words sharing prefixes or suffixes share nodes. Solving walks the graph while
+carrying the wheel's remaining letter counts, never following an edge whose
+letter has been used up, so the work done scales with the number of words the
+wheel can build rather than the size of the dictionary.
+
+Unlike the letter mask index in solver.py, the graph has no fixed alphabet, so
+word lists in any language can be indexed. Word list files are read as UTF-8.
+"""
+
+import io
+
+
+def normalize_word(word):
+    """Return word stripped and upper cased, or None if it has non letters."""
+    word = word.strip().upper()
+    if word and word.isalpha():
+        return word
+    return None
+
+
+class _Node(object):
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+
+
+def _minimize(node, register):
+    """Replace `node`'s subtree with shared equivalent nodes from `register`, and
+    return the node to use in its place.
+    """
+    for ch, child in node.children.items():
+        node.children[ch] = _minimize(child, register)
+
+    signature = (
+        node.terminal,
+        tuple(sorted((ch, id(child)) for ch, child in node.children.items()))
+    )
+    return register.setdefault(signature, node)
+
+
+class DawgIndex(object):
+    """Dictionary of words stored as a minimized DAWG. Words with characters
+    other than letters (of any alphabet) are skipped.
+    """
+    def __init__(self, words=()):
+        self._root = _Node()
+        self.word_count = 0
+        for word in words:
+            word = normalize_word(word)
+            if word is not None and self._insert(word):
+                self.word_count += 1
+
+        register = {}
+        self._root = _minimize(self._root, register)
+        self.node_count = len(register)
+
+    @classmethod
+    def from_file(cls, path):
+        """Return a DawgIndex of a UTF-8 word list file with one word per line."""
+        with io.open(path, encoding="utf-8") as word_file:
+            return cls(word_file)
+
+    def _insert(self, word):
+        """Add word to the trie. Return Boolean indicating if it was new."""
+        node = self._root
+        for ch in word:
+            node = node.children.setdefault(ch, _Node())
+        if node.terminal:
+            return False
+        node.terminal = True
+        return True
+
+    def find(self, center_choice, choices):
+        """Return the set of words that use `center_choice`, and otherwise only
+        letters of `choices` (which include the center), each at most as many
+        times as it appears.
+        """
+        letters_left = {}
+        for ch in choices:
+            letters_left[ch] = letters_left.get(ch, 0) + 1
+        letters = sorted(letters_left)
+        solutions = set()
+
+        def walk(node, prefix, has_center):
+            if node.terminal and has_center:
+                solutions.add(prefix)
+            for ch in letters:
+                if not letters_left[ch]:
+                    continue
+                child = node.children.get(ch)
+                if child is None:
+                    continue
+                letters_left[ch] -= 1
+                walk(child, prefix + ch, has_center or ch == center_choice)
+                letters_left[ch] += 1
+
+        walk(self._root, "", False)
+        return solutions
+
+    def solve(self, wheel):
+        """Fill `wheel.solutions` with every word in the index that the wheel
+        matches, and return it.
+        """
+        wheel.solutions = self.find(wheel.center_choice, wheel.choices)
+        return wheel.solutions
@@ -0,0 +1,252 @@
+
+"""Solver for word wheels (see word_wheel.py). A word list is loaded once and each
+word is preprocessed into a letter count signature and a 26-bit letter mask.
+Words are grouped by mask, so solving a wheel only visits the groups whose mask
+is a subset of the wheel's letters and includes the center letter, and compares
+letter counts for those words alone.
+
+A dictionary may also be compiled into a binary index file, which is opened with
+mmap so solving starts without parsing, and the pages are shared between every
+process using the same file:
+    python solver.py compile words.txt words.idx
+    python solver.py solve words.idx a bcdefgh
+"""
+
+import argparse
+import mmap
+import string
+import struct
+
+from collections import defaultdict
+
+
+ALPHABET = string.ascii_uppercase
+LETTER_BITS = dict((letter, 1 << index) for index, letter in enumerate(ALPHABET))
+
+# Compiled index layout (little-endian): header, bucket table sorted by mask,
+# word table grouped by bucket, then the words themselves as one ASCII blob.
+INDEX_MAGIC = b"WWIX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sHIII")  # Magic, version, buckets, words, blob size.
+INDEX_BUCKET = struct.Struct("<III")  # Letter mask, first word, word count.
+INDEX_WORD = struct.Struct("<IB26s")  # Blob offset, length, letter counts.
+MAX_INDEXED_WORD_LENGTH = 255
+
+
+def get_letter_counts(letters):
+    """Return a tuple of 26 counts, one for each letter of the alphabet."""
+    counts = [0] * len(ALPHABET)
+    for ch in letters:
+        counts[ord(ch) - ord('A')] += 1
+    return tuple(counts)
+
+
+def get_letter_mask(letters):
+    """Return a 26-bit mask with a bit set for each distinct letter."""
+    mask = 0
+    for ch in letters:
+        mask |= LETTER_BITS[ch]
+    return mask
+
+
+def iter_submasks(mask, required=0):
+    """Yield every subset of the bits in `mask` that includes all of `required`."""
+    optional = mask & ~required
+    submask = optional
+    while True:
+        yield submask | required
+        if not submask:
+            return
+        submask = (submask - 1) & optional
+
+
+def normalize_word(word):
+    """Return word stripped and upper cased, or None if it has non A-Z letters."""
+    word = word.strip().upper()
+    if word and all(ch in LETTER_BITS for ch in word):
+        return word
+    return None
+
+
+class WordIndex(object):
+    """Dictionary of words grouped by letter mask, each stored with its letter
+    count signature. Words that are not purely A-Z are skipped.
+    """
+    def __init__(self, words=()):
+        self._buckets = defaultdict(list)
+        self.word_count = 0
+        for word in words:
+            self.add(word)
+
+    @classmethod
+    def from_file(cls, path):
+        """Return a WordIndex of a word list file with one word per line."""
+        with open(path) as word_file:
+            return cls(word_file)
+
+    def add(self, word):
+        """Add word to the index. Return Boolean indicating if it was added."""
+        word = normalize_word(word)
+        if word is None:
+            return False
+
+        self._buckets[get_letter_mask(word)].append((word, get_letter_counts(word)))
+        self.word_count += 1
+        return True
+
+    def _get_bucket(self, mask):
+        """Return (word, letter counts) pairs of words with exactly letter mask `mask`."""
+        return self._buckets.get(mask, ())
+
+    def find(self, center_choice, choices):
+        """Return the set of words that use `center_choice`, and otherwise only
+        letters of `choices` (which include the center), each at most as many
+        times as it appears.
+        """
+        counts = get_letter_counts(choices)
+        letter_indexes = [index for index, count in enumerate(counts) if count]
+        solutions = set()
+        for mask in iter_submasks(get_letter_mask(choices), LETTER_BITS[center_choice]):
+            for word, word_counts in self._get_bucket(mask):
+                if all(word_counts[index] <= counts[index] for index in letter_indexes):
+                    solutions.add(word)
+        return solutions
+
+    def solve(self, wheel):
+        """Fill `wheel.solutions` with every word in the index that the wheel
+        matches, and return it.
+        """
+        wheel.solutions = self.find(wheel.center_choice, wheel.choices)
+        return wheel.solutions
+
+
+class CompiledWordIndex(WordIndex):
+    """Read-only WordIndex backed by a file written by `compile_index`. The file is
+    memory-mapped and records are unpacked only when their bucket is visited.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.bucket_count, self.word_count, blob_size = (
+            INDEX_HEADER.unpack_from(self._map, 0)
+        )
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a compiled word index: {}".format(path))
+        if version != INDEX_VERSION:
+            raise ValueError("Word index version {} not supported.".format(version))
+
+        self._bucket_offset = INDEX_HEADER.size
+        self._word_offset = self._bucket_offset + self.bucket_count * INDEX_BUCKET.size
+        self._blob_offset = self._word_offset + self.word_count * INDEX_WORD.size
+
+    def close(self):
+        self._map.close()
+
+    def add(self, word):
+        raise TypeError("Compiled word indexes are read-only.")
+
+    def _find_bucket(self, mask):
+        """Binary search the bucket table. Return (first word, word count)."""
+        low, high = 0, self.bucket_count
+        while low < high:
+            middle = (low + high) // 2
+            bucket_mask, first_word, word_count = INDEX_BUCKET.unpack_from(
+                self._map,
+                self._bucket_offset + middle * INDEX_BUCKET.size
+            )
+            if bucket_mask == mask:
+                return first_word, word_count
+            if bucket_mask < mask:
+                low = middle + 1
+            else:
+                high = middle
+        return 0, 0
+
+    def _get_bucket(self, mask):
+        first_word, word_count = self._find_bucket(mask)
+        for index in range(first_word, first_word + word_count):
+            offset, length, counts = INDEX_WORD.unpack_from(
+                self._map,
+                self._word_offset + index * INDEX_WORD.size
+            )
+            start = self._blob_offset + offset
+            yield self._map[start:start + length].decode("ascii"), bytearray(counts)
+
+
+def compile_index(words, path):
+    """Compile words into a binary index file at `path` for CompiledWordIndex.
+    Duplicate words, words that are not purely A-Z, and words longer than
+    MAX_INDEXED_WORD_LENGTH letters are skipped. Return the number of words written.
+    """
+    buckets = defaultdict(set)
+    for word in words:
+        word = normalize_word(word)
+        if word is not None and len(word) <= MAX_INDEXED_WORD_LENGTH:
+            buckets[get_letter_mask(word)].add(word)
+
+    bucket_table = []
+    word_table = []
+    blob = []
+    blob_size = 0
+    for mask in sorted(buckets):
+        bucket_table.append(INDEX_BUCKET.pack(mask, len(word_table), len(buckets[mask])))
+        for word in sorted(buckets[mask]):
+            encoded_word = word.encode("ascii")
+            word_table.append(INDEX_WORD.pack(
+                blob_size,
+                len(encoded_word),
+                bytes(bytearray(get_letter_counts(word)))
+            ))
+            blob.append(encoded_word)
+            blob_size += len(encoded_word)
+
+    with open(path, "wb") as index_file:
+        index_file.write(INDEX_HEADER.pack(
+            INDEX_MAGIC,
+            INDEX_VERSION,
+            len(bucket_table),
+            len(word_table),
+            blob_size
+        ))
+        index_file.write(b"".join(bucket_table))
+        index_file.write(b"".join(word_table))
+        index_file.write(b"".join(blob))
+
+    return len(word_table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Compile word lists and solve word wheels."""
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    compile_parser = subparsers.add_parser(
+        "compile",
+        help="Compile a word list into a binary index."
+    )
+    compile_parser.add_argument("word_list", help="Word list file, one word per line.")
+    compile_parser.add_argument("index", help="Path to write the index to.")
+
+    solve_parser = subparsers.add_parser(
+        "solve",
+        help="Print every word a wheel matches."
+    )
+    solve_parser.add_argument("index", help="Compiled index file.")
+    solve_parser.add_argument("center_choice", help="Letter that must be used.")
+    solve_parser.add_argument("choices", help="Other letters of the wheel.")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        with open(args.word_list) as word_file:
+            word_count = compile_index(word_file, args.index)
+        print("Compiled {} words into {}.".format(word_count, args.index))
+    else:
+        from word_wheel import Wheel
+
+        word_index = CompiledWordIndex(args.index)
+        wheel = Wheel(args.center_choice, args.choices)
+        for word in sorted(word_index.solve(wheel), key=lambda word: (len(word), word)):
+            print(word)
@@ -14,14 +14,24 @@ letter is the letter that must be used in all words. Example:
 Valid Words: car, care, race
 Invalid Words: bee (must contain A and not enough E's), bark (no K)
 
+Play interactively with a word list or compiled index (see solver.py):
+    python word_wheel.py words.idx a bcdefgh
+
 """
 
+import argparse
 import atexit
 import curses
 
 from collections import defaultdict
 
 
+# Key codes handled by the game loop.
+ENTER_KEYS = (10, 13, curses.KEY_ENTER)
+BACKSPACE_KEYS = (8, 127, curses.KEY_BACKSPACE)
+QUIT_KEY = 27  # Escape.
+
+
 class Wheel(object):
     def __init__(self, center_choice, choices):
         self.center_choice = center_choice.upper()
@@ -52,6 +62,7 @@ class Wheel(object):
 class Screen(object):
     def __init__(self):
         self.stdscr = curses.initscr()
+        self._closed = False
         #curses.noecho()
         atexit.register(self.cleanup)
 
@@ -59,7 +70,165 @@ class Screen(object):
         self.cleanup()
 
     def cleanup(self):
+        if self._closed:
+            return
+        self._closed = True
         self.stdscr.keypad(0)
         curses.echo();
         curses.nocbreak()
         curses.endwin()
+
+
+class Game(object):
+    """Interactive word wheel game on a Screen. The wheel's solutions must already
+    be filled (see solver.py). They are frozen into a set once, so every guess is
+    checked with a hash lookup. The screen is split into windows, and only the
+    windows whose contents change are redrawn.
+    """
+    WHEEL_HEIGHT = 5
+    INPUT_PROMPT = "Guess: "
+
+    def __init__(self, screen, wheel, min_length=1):
+        self.screen = screen
+        self.wheel = wheel
+        self.min_length = min_length
+        self.solutions = frozenset(
+            solution for solution in wheel.solutions if len(solution) >= min_length
+        )
+        self.totals = dict(
+            (size, len(solutions))
+            for size, solutions in wheel.get_solution_count().items()
+            if size >= min_length
+        )
+        self.found = set()
+        self.found_counts = defaultdict(int)
+        self.score = 0
+        self.guess = ""
+
+        self.width = width = screen.stdscr.getmaxyx()[1]
+        score_height = len(self.totals) + 2
+        self.wheel_window = curses.newwin(self.WHEEL_HEIGHT, width, 0, 0)
+        self.score_window = curses.newwin(score_height, width, self.WHEEL_HEIGHT, 0)
+        self.message_window = curses.newwin(1, width, self.WHEEL_HEIGHT + score_height, 0)
+        self.input_window = curses.newwin(1, width, self.WHEEL_HEIGHT + score_height + 1, 0)
+        self.input_window.keypad(1)
+
+    def check_guess(self, guess):
+        """Record a guess and return a message describing the result."""
+        if guess in self.found:
+            return "{} was already found.".format(guess)
+        if guess not in self.solutions:
+            return "{} is not a solution.".format(guess)
+
+        self.found.add(guess)
+        self.found_counts[len(guess)] += 1
+        self.score += len(guess)
+        return "{} is worth {} points!".format(guess, len(guess))
+
+    def draw_wheel(self):
+        """Draw the letters. They do not change, so this is drawn once."""
+        window = self.wheel_window
+        window.erase()
+        choices = self.wheel.choices[:-1]
+        if len(choices) == 8:
+            rows = (
+                "  {} {} {}".format(*choices[:3]),
+                "  {}[{}]{}".format(choices[3], self.wheel.center_choice, choices[4]),
+                "  {} {} {}".format(*choices[5:]),
+            )
+        else:
+            rows = ("  [{}] {}".format(self.wheel.center_choice, " ".join(choices)),)
+
+        for row_number, row in enumerate(rows, 1):
+            window.addstr(row_number, 0, row)
+        window.noutrefresh()
+
+    def draw_score(self):
+        """Draw the score and the number of solutions found for each length."""
+        window = self.score_window
+        window.erase()
+        window.addstr(0, 0, "Score: {}  Found: {}/{}".format(
+            self.score,
+            len(self.found),
+            len(self.solutions)
+        ))
+        for row_number, size in enumerate(sorted(self.totals), 1):
+            window.addstr(row_number, 0, "{:>2} letters: {}/{}".format(
+                size,
+                self.found_counts[size],
+                self.totals[size]
+            ))
+        window.noutrefresh()
+
+    def draw_message(self, message):
+        window = self.message_window
+        window.erase()
+        window.addstr(0, 0, message[:self.width - 1])
+        window.noutrefresh()
+
+    def draw_input(self):
+        window = self.input_window
+        window.erase()
+        window.addstr(0, 0, (self.INPUT_PROMPT + self.guess)[-(self.width - 1):])
+        window.noutrefresh()
+
+    def run(self):
+        """Take guesses until every solution is found or Escape is pressed."""
+        curses.noecho()
+        curses.cbreak()
+        self.screen.stdscr.noutrefresh()
+        self.draw_wheel()
+        self.draw_score()
+        self.draw_message("Type a word and press ENTER. Press ESC to quit.")
+        self.draw_input()
+        curses.doupdate()
+
+        while len(self.found) < len(self.solutions):
+            key = self.input_window.getch()
+            if key == QUIT_KEY:
+                break
+            elif key in ENTER_KEYS:
+                if self.guess:
+                    self.draw_message(self.check_guess(self.guess))
+                    self.draw_score()
+                self.guess = ""
+            elif key in BACKSPACE_KEYS:
+                self.guess = self.guess[:-1]
+            elif 0 <= key < 256 and chr(key).isalpha():
+                self.guess += chr(key).upper()
+            else:
+                continue
+
+            self.draw_input()
+            curses.doupdate()
+
+        return self.score
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Play a word wheel."""
+    )
+
+    parser.add_argument("index", help="Compiled index or word list file.")
+    parser.add_argument("center_choice", help="Letter that must be used.")
+    parser.add_argument("choices", help="Other letters of the wheel.")
+
+    parser.add_argument(
+        "--min-length",
+        type=int,
+        default=4,
+        help="Shortest word accepted as a solution."
+    )
+
+    args = parser.parse_args()
+
+    from batch import load_word_index
+
+    wheel = Wheel(args.center_choice, args.choices)
+    load_word_index(args.index).solve(wheel)
+
+    screen = Screen()
+    score = Game(screen, wheel, min_length=args.min_length).run()
+    screen.cleanup()
+    print("Final score: {}".format(score))
@@ -1,7 +1,18 @@
 
-import pickle
+import logging
+import math
+import os
+import random
+import redis
+import threading
+import time
+import timeit
+import uuid
 
+from collections import namedtuple, OrderedDict
 from functools import wraps
+from wrappers.redis_pool import get_redis_connection
+from wrappers.serialization import Codec
 
 
 CACHE_STORAGE = ('redis', 'simple')
@@ -9,37 +20,315 @@ CACHE_STORAGE = ('redis', 'simple')
 # Number of seconds before timing out.
 DEFAULT_TIMEOUT = 60 * 5
 
+# Name of the redis_pool connection pool used for caching.
+DEFAULT_POOL_NAME = "memoization"
+
+# Maximum number of entries kept by SimpleStrategy.
+DEFAULT_MAX_SIZE = 1024
+
+# Seconds TieredStrategy keeps values locally, bounding staleness should an
+# invalidation message be missed.
+DEFAULT_LOCAL_TIMEOUT = 60
+
+# Invalidated keys are published to this channel prefix plus the cache key prefix.
+INVALIDATION_CHANNEL_PREFIX = "memoization_invalidate:"
+
+# Seconds to wait before resubscribing after the invalidation listener fails.
+LISTENER_RETRY_INTERVAL = 1
+
+# Seconds the invalidation listener waits for each message. Kept below the pool's
+# socket timeout, so a quiet channel does not time out the read.
+LISTENER_POLL_INTERVAL = 1
+
+# Seconds a worker may hold the lock to recompute a missing value, and suffix of
+# the lock key in Redis.
+DEFAULT_RECOMPUTE_LOCK_TIMEOUT = 10
+RECOMPUTE_LOCK_SUFFIX = ":recompute"
+
+# Waiting for another worker's recomputed value polls after this many seconds,
+# doubling for each poll up to RECOMPUTE_POLL_MAX seconds.
+RECOMPUTE_POLL_BASE = 0.01
+RECOMPUTE_POLL_MAX = 0.5
+
+# Delete KEYS[1] only if it still holds token ARGV[1].
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+logger = logging.getLogger(__name__)
+
+# Returned by `CacheStrategy.get` for keys that are not cached, as None may be cached.
+_MISSING = object()
+
+# Memoized values are cached wrapped with the time they go stale and the seconds
+# they took to compute, for stale serving and early refresh.
+_Envelope = namedtuple("_Envelope", ("value", "expires_at", "compute_seconds"))
+
+# Serialization header flag of envelopes, stored as plain sequences.
+ENVELOPE_FLAG = 1
+
+
+class _Flight(object):
+    """Result of a computation that concurrent callers in this process wait for."""
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._exception = None
+
+    def set_result(self, value=None, exception=None):
+        self._value = value
+        self._exception = exception
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
 
 class CacheStrategy(object):
+    """Base for caches used to memoize functions. Subclasses implement `get`, `set`
+    and `invalidate_key`.
+    """
     def __init__(self, cache_key_prefix=""):
         self.cache_key_prefix = cache_key_prefix
+        self._flights = {}
+        self._flights_lock = threading.Lock()
 
-    def cache_with_memoization(timeout=CACHE_DEFAULT_TIMEOUT):
+    def cache_with_memoization(
+        self,
+        timeout=DEFAULT_TIMEOUT,
+        stale_timeout=0,
+        early_refresh=0,
+        lock_timeout=DEFAULT_RECOMPUTE_LOCK_TIMEOUT,
+        batch_loader=None
+    ):
         """
         Decorator for functions that use the cache.
         This will memoize args and kwargs (using __str__). Note that this will treat
         unique instances of non-primitives as separate.
+
+        Concurrent misses on a key in one process wait for a single call, and across
+        processes only the holder of a recompute lock (held up to `lock_timeout`
+        seconds, None to disable) calls the function while others wait for its
+        value. Values are kept `stale_timeout` seconds past `timeout`, during which
+        one caller recomputes while the rest are served the stale value. With
+        `early_refresh` (e.g. 1.0), callers recompute with rising probability as
+        expiry nears, scaled by how long the function took to compute.
+
+        The decorated function also gets a `many(items, *args, **kwargs)` method,
+        returning the results for each of `items` as the first argument, in order.
+        It reads every key in one round trip, computes only the missing ones (or
+        all at once with `batch_loader(missing_items, *args, **kwargs)`, returning
+        a list in the same order or a dict by item), and writes them back in one
+        round trip. Batches are not coalesced with other callers, and stale values
+        are recomputed rather than served.
         """
         def _decorator(run_function):
-            @functools.wraps(run_function)
+            @wraps(run_function)
             def _caller(*args, **kwargs):
                 # Check for cached response.
-                cache = _get_redis_connection()
-                key = get_key(run_function.__name__, *args, **kwargs)
-                cached_response = cache.get(key)
-                if cached_response:
-                    unpickled_response = pickle.loads(cached_response)
-                    return unpickled_response
-
-                # Execute function and cache pickled response.
-                response = run_function(*args, **kwargs)
-                picked_response = pickle.dumps(response)
-                cache.setex(key, picked_response, timeout)
-                return response
+                key = self.get_key(run_function.__name__, *args, **kwargs)
+                envelope = self._get_envelope(key)
+                if envelope is not None and not self._should_refresh(envelope, early_refresh):
+                    return envelope.value
 
+                def compute():
+                    return run_function(*args, **kwargs)
+
+                return self._refresh(
+                    key,
+                    compute,
+                    timeout,
+                    stale_timeout,
+                    lock_timeout,
+                    envelope
+                )
+
+            def many(items, *args, **kwargs):
+                return self._call_many(
+                    run_function,
+                    batch_loader,
+                    timeout,
+                    stale_timeout,
+                    early_refresh,
+                    items,
+                    args,
+                    kwargs
+                )
+
+            _caller.many = many
             return _caller
         return _decorator
 
+    def _call_many(
+        self,
+        run_function,
+        batch_loader,
+        timeout,
+        stale_timeout,
+        early_refresh,
+        items,
+        args,
+        kwargs
+    ):
+        """Return run_function's results for each of items, reading and writing the
+        cache once (see `cache_with_memoization`).
+        """
+        items = list(items)
+        keys = [self.get_key(run_function.__name__, item, *args, **kwargs) for item in items]
+        envelopes = dict(
+            (key, self._to_envelope(cached_response))
+            for key, cached_response in zip(keys, self.get_many(keys))
+        )
+
+        missing = OrderedDict()
+        for key, item in zip(keys, items):
+            envelope = envelopes[key]
+            if envelope is None or self._should_refresh(envelope, early_refresh):
+                missing.setdefault(key, item)
+
+        if missing:
+            started = timeit.default_timer()
+            missing_items = list(missing.values())
+            if batch_loader is None:
+                values = [run_function(item, *args, **kwargs) for item in missing_items]
+            else:
+                values = batch_loader(missing_items, *args, **kwargs)
+                if isinstance(values, dict):
+                    values = [values[item] for item in missing_items]
+            compute_seconds = (timeit.default_timer() - started) / len(missing)
+
+            expires_at = None if timeout is None else time.time() + timeout
+            computed = [
+                (key, _Envelope(value, expires_at, compute_seconds))
+                for key, value in zip(missing, values)
+            ]
+            self.set_many(computed, None if timeout is None else timeout + stale_timeout)
+            envelopes.update(computed)
+
+        return [envelopes[key].value for key in keys]
+
+    def _get_envelope(self, key):
+        """Return the _Envelope cached for key, or None."""
+        return self._to_envelope(self.get(key))
+
+    def _to_envelope(self, cached_response):
+        if cached_response is _MISSING:
+            return None
+        if not isinstance(cached_response, _Envelope):
+            # Cached without an envelope, by `set`.
+            return _Envelope(cached_response, None, 0)
+        return cached_response
+
+    def _should_refresh(self, envelope, early_refresh):
+        """Return Boolean indicating if a cached envelope is stale, or should be
+        refreshed early (probabilistic early expiration).
+        """
+        if envelope.expires_at is None:
+            return False
+        now = time.time()
+        if early_refresh and envelope.compute_seconds:
+            # 1 - random() is in (0, 1], so the log is defined.
+            now -= envelope.compute_seconds * early_refresh * math.log(1 - random.random())
+        return now >= envelope.expires_at
+
+    def _refresh(self, key, compute, timeout, stale_timeout, lock_timeout, stale_envelope):
+        """Recompute and cache the value of key, once for all concurrent callers in
+        this process. Other callers wait for the value, or are returned the stale
+        one when there is one.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if stale_envelope is not None:
+                return stale_envelope.value
+            return flight.wait()
+
+        try:
+            value = self._recompute(
+                key,
+                compute,
+                timeout,
+                stale_timeout,
+                lock_timeout,
+                stale_envelope
+            )
+        except BaseException as e:
+            flight.set_result(exception=e)
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+
+    def _recompute(self, key, compute, timeout, stale_timeout, lock_timeout, stale_envelope):
+        """Call compute and cache its value, unless another worker holds the
+        recompute lock, in which case the stale value or (after waiting) that
+        worker's value is returned.
+        """
+        token = None
+        if lock_timeout is not None:
+            token = self._acquire_recompute_lock(key, lock_timeout)
+            if token is None:
+                if stale_envelope is not None:
+                    return stale_envelope.value
+                envelope = self._wait_for_envelope(key, lock_timeout)
+                if envelope is not None:
+                    return envelope.value
+                # The other worker did not finish in time, so compute anyway.
+
+        try:
+            started = timeit.default_timer()
+            value = compute()
+            compute_seconds = timeit.default_timer() - started
+
+            if timeout is None:
+                self.set(key, _Envelope(value, None, compute_seconds), None)
+            else:
+                self.set(
+                    key,
+                    _Envelope(value, time.time() + timeout, compute_seconds),
+                    timeout + stale_timeout
+                )
+            return value
+        finally:
+            if token is not None:
+                self._release_recompute_lock(key, token)
+
+    def _wait_for_envelope(self, key, timeout):
+        """Poll for a value of key for up to timeout seconds. Return its _Envelope,
+        or None if none was cached in time.
+        """
+        deadline = time.time() + timeout
+        delay = RECOMPUTE_POLL_BASE
+        while True:
+            time.sleep(min(delay, max(0, deadline - time.time())))
+            envelope = self._get_envelope(key)
+            if envelope is not None or time.time() >= deadline:
+                return envelope
+            delay = min(delay * 2, RECOMPUTE_POLL_MAX)
+
+    def _acquire_recompute_lock(self, key, timeout):
+        """Return a token if this process may recompute key, or None if another
+        process is already. In-process callers are coalesced before this is
+        called, so by default every process may.
+        """
+        return True
+
+    def _release_recompute_lock(self, key, token):
+        pass
+
     def get_key(self, function_name, *args, **kwargs):
         """
         Create a consistent cache key based off of __str__ representation of args
@@ -49,17 +338,305 @@ class CacheStrategy(object):
             self.cache_key_prefix,
             function_name,
             tuple(arg for arg in args if arg),
-            "&".join("{}={}".format(k, v) for k, v in sorted(kwargs.iteritems()) if v)
+            "&".join("{}={}".format(k, v) for k, v in sorted(kwargs.items()) if v)
         )
 
+    def get(self, key):
+        """Return the value cached for key, or _MISSING."""
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        """Cache value for key, for timeout seconds (or without expiry if None)."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return a list of the value cached for each key, or _MISSING."""
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items, timeout=DEFAULT_TIMEOUT):
+        """Cache each (key, value) of items, for timeout seconds."""
+        for key, value in items:
+            self.set(key, value, timeout)
+
     def invalidate_key(self, key):
         """Delete cached function with methods."""
-        self.cache.expire(key, 0)
+        raise NotImplementedError
 
 
 class RedisCacheStrategy(CacheStrategy):
-    pass
+    """Caches values in Redis, shared by every process. Values are written with
+    `codec` (a serialization.Codec, pickle with zlib compression by default), and
+    values written with any codec can be read.
+    """
+    def __init__(self, cache_key_prefix="", pool_name=DEFAULT_POOL_NAME, codec=None):
+        super(RedisCacheStrategy, self).__init__(cache_key_prefix)
+        self.pool_name = pool_name
+        self.codec = codec or Codec()
+
+    @property
+    def cache(self):
+        """Pooled Redis client of the current process."""
+        return get_redis_connection(self.pool_name)
+
+    def _loads(self, cached_response):
+        if cached_response is None:
+            return _MISSING
+
+        value, flags = self.codec.loads_with_flags(cached_response)
+        if flags & ENVELOPE_FLAG:
+            return _Envelope(*value)
+        return value
+
+    def _write(self, client, key, value, timeout):
+        """Queue or send the command caching value for key with client."""
+        if isinstance(value, _Envelope):
+            # Stored as a sequence, which every serializer supports.
+            data = self.codec.dumps(list(value), ENVELOPE_FLAG)
+        else:
+            data = self.codec.dumps(value)
+
+        if timeout is None:
+            client.set(key, data)
+        elif timeout == int(timeout):
+            client.setex(name=key, time=int(timeout), value=data)
+        else:
+            client.psetex(name=key, time_ms=int(timeout * 1000), value=data)
+
+    def get(self, key):
+        return self._loads(self.cache.get(key))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._write(self.cache, key, value, timeout)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return [self._loads(cached_response) for cached_response in self.cache.mget(keys)]
+
+    def set_many(self, items, timeout=DEFAULT_TIMEOUT):
+        pipeline = self.cache.pipeline(transaction=False)
+        for key, value in items:
+            self._write(pipeline, key, value, timeout)
+        pipeline.execute()
+
+    def invalidate_key(self, key):
+        self.cache.expire(key, 0)
+
+    def _acquire_recompute_lock(self, key, timeout):
+        token = uuid.uuid4().hex
+        if self.cache.set(key + RECOMPUTE_LOCK_SUFFIX, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    def _release_recompute_lock(self, key, token):
+        self.cache.eval(_RELEASE_SCRIPT, 1, key + RECOMPUTE_LOCK_SUFFIX, token)
 
 
 class SimpleStrategy(CacheStrategy):
-    pass
+    """Thread-safe in-process cache of up to `max_size` entries, evicting the least
+    recently used entry when full. Values are stored as is, not copied.
+    """
+    def __init__(self, cache_key_prefix="", max_size=DEFAULT_MAX_SIZE):
+        super(SimpleStrategy, self).__init__(cache_key_prefix)
+        if max_size <= 0:
+            raise AttributeError("max_size must be positive.")
+
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Key to (expiry time or None, value), least recently used first.
+        self._entries = OrderedDict()
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+
+            # Reinsert as the most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        expires_at = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_stats(self):
+        """Return a dict of hit, miss, eviction and expiration counts, and size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+class TieredStrategy(CacheStrategy):
+    """Caches values in a bounded in-process SimpleStrategy in front of a shared
+    RedisCacheStrategy (written with `codec`). Lookups are served locally when possible, and misses
+    fill both tiers. Invalidations are published over Redis, and a background
+    thread in each process evicts the local copies of keys invalidated anywhere.
+    Local copies are kept for at most `local_timeout` seconds.
+    """
+    def __init__(
+        self,
+        cache_key_prefix="",
+        pool_name=DEFAULT_POOL_NAME,
+        max_size=DEFAULT_MAX_SIZE,
+        local_timeout=DEFAULT_LOCAL_TIMEOUT,
+        codec=None
+    ):
+        super(TieredStrategy, self).__init__(cache_key_prefix)
+        self.local = SimpleStrategy(cache_key_prefix, max_size)
+        self.remote = RedisCacheStrategy(cache_key_prefix, pool_name, codec)
+        self.local_timeout = local_timeout
+        self.channel = INVALIDATION_CHANNEL_PREFIX + cache_key_prefix
+
+        self._listener_lock = threading.Lock()
+        self._listener_pid = None
+        self.remote_hits = 0
+        self.remote_misses = 0
+
+    def _get_local_timeout(self, timeout):
+        if timeout is None:
+            return self.local_timeout
+        if self.local_timeout is None:
+            return timeout
+        return min(timeout, self.local_timeout)
+
+    def get(self, key):
+        self._start_listener()
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+
+        value = self.remote.get(key)
+        if value is _MISSING:
+            self.remote_misses += 1
+            return _MISSING
+
+        self.remote_hits += 1
+        self.local.set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._start_listener()
+        self.remote.set(key, value, timeout)
+        self.local.set(key, value, self._get_local_timeout(timeout))
+
+    def get_many(self, keys):
+        self._start_listener()
+        keys = list(keys)
+        values = [self.local.get(key) for key in keys]
+        missing = [index for index, value in enumerate(values) if value is _MISSING]
+        if not missing:
+            return values
+
+        remote_values = self.remote.get_many([keys[index] for index in missing])
+        for index, value in zip(missing, remote_values):
+            if value is _MISSING:
+                self.remote_misses += 1
+                continue
+            self.remote_hits += 1
+            self.local.set(keys[index], value, self.local_timeout)
+            values[index] = value
+        return values
+
+    def set_many(self, items, timeout=DEFAULT_TIMEOUT):
+        self._start_listener()
+        items = list(items)
+        self.remote.set_many(items, timeout)
+        for key, value in items:
+            self.local.set(key, value, self._get_local_timeout(timeout))
+
+    def invalidate_key(self, key):
+        self.remote.invalidate_key(key)
+        self.local.invalidate_key(key)
+        self.remote.cache.publish(self.channel, key)
+
+    def _acquire_recompute_lock(self, key, timeout):
+        return self.remote._acquire_recompute_lock(key, timeout)
+
+    def _release_recompute_lock(self, key, token):
+        self.remote._release_recompute_lock(key, token)
+
+    def get_stats(self):
+        """Return the local cache's stats, with Redis hit and miss counts."""
+        stats = self.local.get_stats()
+        stats.update({"remote_hits": self.remote_hits, "remote_misses": self.remote_misses})
+        return stats
+
+    def _start_listener(self):
+        """Start the invalidation listener, once per process."""
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._listener_lock:
+            if self._listener_pid != os.getpid():
+                # Forked: the parent's local copies are kept, but its thread is not.
+                thread = threading.Thread(target=self._listen, name="memoization-invalidator")
+                thread.daemon = True
+                thread.start()
+                self._listener_pid = os.getpid()
+
+    def _listen(self):
+        while True:
+            pubsub = self.remote.cache.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Invalidations published while unsubscribed were missed.
+                self.local.clear()
+                while True:
+                    try:
+                        message = pubsub.get_message(timeout=LISTENER_POLL_INTERVAL)
+                    except redis.TimeoutError:
+                        # No message arrived, the subscription is still intact.
+                        continue
+                    if message is None:
+                        continue
+
+                    key = message["data"]
+                    if not isinstance(key, str):
+                        key = key.decode("utf-8")
+                    self.local.invalidate_key(key)
+            except redis.RedisError:
+                logger.exception("Memoization invalidation listener failed, resubscribing.")
+            finally:
+                pubsub.close()
+
+            self.local.clear()
+            time.sleep(LISTENER_RETRY_INTERVAL)
@@ -0,0 +1,179 @@
+import os
+import redis
+import threading
+
+"""Shared Redis connection pools. Every module that talks to Redis asks this module
+for a client instead of building its own, so each process keeps one bounded pool
+of persistent connections per configuration. Pools are rebuilt after a fork, so
+forked workers (e.g. Celery prefork) never share sockets with their parent.
+
+Example usage:
+```
+configure("locks", url="redis://localhost:6379/1", max_connections=20)
+get_redis_connection("locks").set("key", "value")
+```
+"""
+
+DEFAULT_NAME = "default"
+
+# Connection params.
+DEFAULT_DB = 0
+DEFAULT_HOST = "localhost"
+DEFAULT_PASSWORD = None
+DEFAULT_PORT = 6379
+
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_POOL_TIMEOUT = 20  # Seconds to wait for a free connection.
+DEFAULT_SOCKET_TIMEOUT = 5
+DEFAULT_SOCKET_CONNECT_TIMEOUT = 5
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+class RedisPoolProvider(object):
+    """Lazily builds a connection pool and a client using it, and rebuilds both
+    when the current process id differs from the one they were built in.
+
+    Connects with `url` if given, otherwise to `unix_socket_path` if given,
+    otherwise to `host` and `port`. When `pool_timeout` is not None, callers wait
+    up to that many seconds for a free connection once `max_connections` are in
+    use, instead of an error being raised.
+    """
+    def __init__(
+        self,
+        url=None,
+        unix_socket_path=None,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        db=DEFAULT_DB,
+        password=DEFAULT_PASSWORD,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        pool_timeout=DEFAULT_POOL_TIMEOUT,
+        socket_timeout=DEFAULT_SOCKET_TIMEOUT,
+        socket_connect_timeout=DEFAULT_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        socket_keepalive_options=None,
+        health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL
+    ):
+        self.url = url
+        self.unix_socket_path = unix_socket_path
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.socket_keepalive = socket_keepalive
+        self.socket_keepalive_options = socket_keepalive_options
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Lock()
+        self._pool = None
+        self._client = None
+        self._pid = None
+
+    def get_pool_params(self):
+        params = {
+            "db": self.db,
+            "password": self.password,
+            "max_connections": self.max_connections,
+            "socket_timeout": self.socket_timeout,
+            "health_check_interval": self.health_check_interval,
+        }
+        if self.pool_timeout is not None:
+            params["timeout"] = self.pool_timeout
+
+        if self.unix_socket_path and not self.url:
+            params.update({
+                "connection_class": redis.UnixDomainSocketConnection,
+                "path": self.unix_socket_path,
+            })
+        else:
+            # Socket options that only apply to TCP connections.
+            params.update({
+                "socket_connect_timeout": self.socket_connect_timeout,
+                "socket_keepalive": self.socket_keepalive,
+                "socket_keepalive_options": self.socket_keepalive_options,
+            })
+            if not self.url:
+                params.update({"host": self.host, "port": self.port})
+
+        return params
+
+    def _create_pool(self):
+        pool_class = (
+            redis.ConnectionPool if self.pool_timeout is None else redis.BlockingConnectionPool
+        )
+        params = self.get_pool_params()
+        if self.url:
+            # Settings given in the URL take precedence over the defaults.
+            for key in ("db", "password"):
+                params.pop(key)
+            return pool_class.from_url(self.url, **params)
+        return pool_class(**params)
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Drop (without disconnecting) anything inherited from the parent, as
+                # its sockets are still in use there.
+                self._pool = self._create_pool()
+                self._client = redis.Redis(connection_pool=self._pool)
+                self._pid = os.getpid()
+
+    @property
+    def pool(self):
+        self._check_pid()
+        return self._pool
+
+    @property
+    def client(self):
+        self._check_pid()
+        return self._client
+
+    def close(self):
+        """Disconnect every connection of this process's pool."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.disconnect()
+            self._pool = None
+            self._client = None
+            self._pid = None
+
+
+def configure(name=DEFAULT_NAME, **settings):
+    """Set the connection settings (see RedisPoolProvider) used for `name`, closing
+    any pool previously configured for it. Return the new provider.
+    """
+    provider = RedisPoolProvider(**settings)
+    with _providers_lock:
+        previous = _providers.get(name)
+        _providers[name] = provider
+    if previous is not None:
+        previous.close()
+    return provider
+
+
+def get_provider(name=DEFAULT_NAME, **defaults):
+    """Return the provider for `name`, creating it from `defaults` if `name` was
+    not configured yet.
+    """
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                provider = _providers[name] = RedisPoolProvider(**defaults)
+    return provider
+
+
+def get_redis_connection(name=DEFAULT_NAME, **defaults):
+    """Return this process's pooled Redis client for `name`."""
+    return get_provider(name, **defaults).client
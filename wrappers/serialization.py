@@ -0,0 +1,206 @@
+import argparse
+import json
+import marshal
+import pickle
+import struct
+import timeit
+import zlib
+
+from collections import namedtuple, OrderedDict
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+"""Serializers and compressors for cached values. Every value is written with a
+small header naming the serializer and compressor used, so readers can decode
+values written with any codec. Data without the header is read as a plain pickle,
+as written before headers were added.
+
+Compare codecs on sample payloads with:
+    python serialization.py --rows 1000
+"""
+
+# Header layout: magic, serializer id, compressor id, flags (for the caller's use).
+HEADER = struct.Struct(">BBBB")
+HEADER_MAGIC = 0xCA  # Not a valid first byte of a pickle.
+
+DEFAULT_SERIALIZER = "pickle"
+DEFAULT_COMPRESSOR = "zlib"
+
+# Serialized values smaller than this many bytes are stored uncompressed.
+DEFAULT_COMPRESS_THRESHOLD = 1024
+ZLIB_LEVEL = 6
+
+Serializer = namedtuple("Serializer", ("name", "id", "dumps", "loads"))
+Compressor = namedtuple("Compressor", ("name", "id", "compress", "decompress"))
+
+SERIALIZERS = OrderedDict()
+COMPRESSORS = OrderedDict()
+
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def _pickle_dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _identity(data):
+    return data
+
+
+def register_serializer(serializer):
+    """Register a Serializer under its name and id, replacing any with the same name."""
+    SERIALIZERS[serializer.name] = serializer
+
+
+def register_compressor(compressor):
+    """Register a Compressor under its name and id, replacing any with the same name."""
+    COMPRESSORS[compressor.name] = compressor
+
+
+def _get_by_id(registry, registry_id, kind):
+    for entry in registry.values():
+        if entry.id == registry_id:
+            return entry
+    raise ValueError("Unknown {} id {}.".format(kind, registry_id))
+
+
+def _get_by_name(registry, name, kind):
+    try:
+        return registry[name]
+    except KeyError:
+        raise AttributeError("{} {} not supported.".format(kind, name))
+
+
+# Pickle handles any picklable value. JSON turns tuples into lists and only
+# supports string dict keys. Marshal only handles builtin types, and its format
+# may change between Python versions.
+register_serializer(Serializer("pickle", 1, _pickle_dumps, pickle.loads))
+register_serializer(Serializer("json", 2, _json_dumps, _json_loads))
+register_serializer(Serializer("marshal", 3, marshal.dumps, marshal.loads))
+
+register_compressor(Compressor("none", 0, _identity, _identity))
+register_compressor(Compressor(
+    "zlib",
+    1,
+    lambda data: zlib.compress(data, ZLIB_LEVEL),
+    zlib.decompress
+))
+if lz4 is not None:
+    register_compressor(Compressor("lz4", 2, lz4.frame.compress, lz4.frame.decompress))
+
+
+class Codec(object):
+    """Serializes values with `serializer` and, when the result is at least
+    `threshold` bytes, compresses them with `compressor` (kept only if smaller).
+    """
+    def __init__(
+        self,
+        serializer=DEFAULT_SERIALIZER,
+        compressor=DEFAULT_COMPRESSOR,
+        threshold=DEFAULT_COMPRESS_THRESHOLD
+    ):
+        self.serializer = _get_by_name(SERIALIZERS, serializer, "Serializer")
+        self.compressor = _get_by_name(COMPRESSORS, compressor, "Compressor")
+        self.threshold = threshold
+
+    def dumps(self, value, flags=0):
+        """Return value serialized, possibly compressed, behind a header."""
+        data = self.serializer.dumps(value)
+        compressor = COMPRESSORS["none"]
+        if len(data) >= self.threshold and self.compressor.id != compressor.id:
+            compressed_data = self.compressor.compress(data)
+            if len(compressed_data) < len(data):
+                data = compressed_data
+                compressor = self.compressor
+
+        return HEADER.pack(HEADER_MAGIC, self.serializer.id, compressor.id, flags) + data
+
+    def loads(self, data):
+        """Return the value of data written by any Codec's `dumps`."""
+        return self.loads_with_flags(data)[0]
+
+    def loads_with_flags(self, data):
+        """Return (value, flags) of data written by any Codec's `dumps`. Flags of
+        data without a header are 0.
+        """
+        if len(data) < HEADER.size or bytearray(data[:1])[0] != HEADER_MAGIC:
+            return pickle.loads(data), 0
+
+        _, serializer_id, compressor_id, flags = HEADER.unpack_from(data)
+        serializer = _get_by_id(SERIALIZERS, serializer_id, "serializer")
+        compressor = _get_by_id(COMPRESSORS, compressor_id, "compressor")
+        return serializer.loads(compressor.decompress(data[HEADER.size:])), flags
+
+
+def get_sample_payload(rows):
+    """Return a list of `rows` dicts resembling cached query results."""
+    return [
+        {
+            "id": index,
+            "name": "item-{}".format(index),
+            "price": index * 1.25,
+            "active": index % 3 != 0,
+            "tags": ["tag-{}".format(index % 7), "tag-{}".format(index % 11)],
+        }
+        for index in range(rows)
+    ]
+
+
+def benchmark(value, number):
+    """Yield (serializer, compressor, size, dumps seconds, loads seconds) for every
+    registered combination, averaged over `number` calls each.
+    """
+    for serializer in SERIALIZERS:
+        for compressor in COMPRESSORS:
+            codec = Codec(serializer, compressor, threshold=0)
+            data = codec.dumps(value)
+            dumps_seconds = timeit.timeit(lambda: codec.dumps(value), number=number) / number
+            loads_seconds = timeit.timeit(lambda: codec.loads(data), number=number) / number
+            yield serializer, compressor, len(data), dumps_seconds, loads_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Compare cached value size and latency of every codec."""
+    )
+
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1000,
+        help="Number of dicts in the sample payload."
+    )
+
+    parser.add_argument(
+        "--number",
+        "-n",
+        type=int,
+        default=100,
+        help="Number of calls timed per codec."
+    )
+
+    args = parser.parse_args()
+
+    print("{:<12}{:<8}{:>12}{:>12}{:>12}".format(
+        "serializer", "comp.", "bytes", "dumps us", "loads us"
+    ))
+    for serializer, compressor, size, dumps_seconds, loads_seconds in benchmark(
+        get_sample_payload(args.rows),
+        args.number
+    ):
+        print("{:<12}{:<8}{:>12}{:>12.1f}{:>12.1f}".format(
+            serializer,
+            compressor,
+            size,
+            dumps_seconds * 1e6,
+            loads_seconds * 1e6
+        ))